@@ -0,0 +1,2 @@
+call venv\Scripts\activate.bat
+python batch_sync.py %*
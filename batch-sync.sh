@@ -0,0 +1,3 @@
+#!/usr/bin/env sh
+source venv/bin/activate
+python batch_sync.py "$@"
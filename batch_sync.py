@@ -0,0 +1,10 @@
+import logging
+import os.path
+import sys
+
+logging.basicConfig(level=logging.INFO)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from toggl_to_jira_sync import batch
+
+if __name__ == "__main__":
+    batch.main()
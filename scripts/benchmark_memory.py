@@ -0,0 +1,132 @@
+import argparse
+import datetime
+import os.path
+import random
+import sys
+import tracemalloc
+from collections import namedtuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync.apis import JiraApi, JiraWorklogFilter, TogglApi
+from toggl_to_jira_sync.formats import datetime_jira_format, datetime_toggl_format
+
+ISSUES = ["WEB-1", "WEB-2", "BACK-1", "OPS-1"]
+AUTHOR = "john.doe"
+
+# the entry model before the compact classes, kept here as the baseline
+LegacyWorklogEntry = namedtuple("LegacyWorklogEntry", ["issue", "start", "stop", "comment", "tag"])
+LegacyJiraTag = namedtuple("LegacyJiraTag", ["id", "raw_entry"])
+LegacyTogglTag = namedtuple("LegacyTogglTag", [
+    "id", "project_name", "project_pid", "billable", "jira_project", "raw_entry",
+])
+
+
+def generate_payloads(count, seed):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    toggl_entries = []
+    jira_worklogs = []
+    for i in range(count):
+        start += datetime.timedelta(minutes=rnd.randint(10, 90))
+        duration = rnd.randint(5, 120) * 60
+        issue = rnd.choice(ISSUES)
+        # the comments are decoded separately for each entry, just like json.loads does with API responses
+        comment = "".join([issue, ": ", "work"])
+        toggl_entries.append({
+            "id": i,
+            "wid": 1,
+            "pid": None,
+            "uid": 1,
+            "billable": False,
+            "start": datetime_toggl_format.to_str(start),
+            "stop": datetime_toggl_format.to_str(start + datetime.timedelta(seconds=duration)),
+            "duration": duration,
+            "description": comment,
+            "duronly": False,
+            "at": datetime_toggl_format.to_str(start),
+        })
+        jira_worklogs.append({
+            "self": "https://jira.example.com/rest/api/2/issue/{}/worklog/{}".format(issue, i),
+            "author": {"key": AUTHOR, "name": AUTHOR, "displayName": "John Doe", "active": True},
+            "updateAuthor": {"key": AUTHOR, "name": AUTHOR, "displayName": "John Doe", "active": True},
+            "comment": "".join(["work"]),
+            "created": datetime_jira_format.to_str(start),
+            "updated": datetime_jira_format.to_str(start),
+            "started": datetime_jira_format.to_str(start),
+            "timeSpent": "{}m".format(duration // 60),
+            "timeSpentSeconds": duration,
+            "id": str(i),
+            "issueId": str(10000 + ISSUES.index(issue)),
+        })
+    return toggl_entries, jira_worklogs
+
+
+def compact_entries(toggl_entries, jira_worklogs):
+    worklog_filter = JiraWorklogFilter(author=AUTHOR, min_date=None, max_date=None)
+    toggl = [TogglApi._extract_entry(entry, None, None) for entry in toggl_entries]
+    jira = []
+    for worklog in jira_worklogs:
+        issue = {"key": ISSUES[int(worklog["issueId"]) - 10000]}
+        jira.extend(JiraApi._extract_worklogs(worklog_filter, issue, [worklog]))
+    return toggl, jira
+
+
+def legacy_entries(toggl_entries, jira_worklogs):
+    toggl = [
+        LegacyWorklogEntry(
+            issue=TogglApi._extract_issue(entry["description"]),
+            start=datetime_toggl_format.from_str(entry["start"]),
+            stop=datetime_toggl_format.from_str(entry["stop"]),
+            comment=entry["description"],
+            tag=LegacyTogglTag(
+                id=entry["id"],
+                project_name=None,
+                project_pid=None,
+                billable=entry["billable"],
+                jira_project=None,
+                raw_entry=entry,
+            ),
+        )
+        for entry in toggl_entries
+    ]
+    jira = [
+        LegacyWorklogEntry(
+            issue=ISSUES[int(worklog["issueId"]) - 10000],
+            start=datetime_jira_format.from_str(worklog["started"]),
+            stop=datetime_jira_format.from_str(worklog["started"]) + datetime.timedelta(
+                seconds=worklog["timeSpentSeconds"]),
+            comment=worklog["comment"],
+            tag=LegacyJiraTag(id=worklog["id"], raw_entry=worklog),
+        )
+        for worklog in jira_worklogs
+    ]
+    return toggl, jira
+
+
+def measure(fn, count):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    toggl_entries, jira_worklogs = generate_payloads(count, seed=1)
+    entries = fn(toggl_entries, jira_worklogs)
+    # the raw payloads are dropped, whatever the entries still reference stays allocated
+    del toggl_entries, jira_worklogs
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del entries
+    return retained - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory retained by worklog entries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print("{:>8} {:>14} {:>14} {:>10}".format("entries", "legacy [KiB]", "compact [KiB]", "ratio"))
+    for size in args.sizes:
+        legacy = measure(legacy_entries, size)
+        compact = measure(compact_entries, size)
+        print("{:>8} {:14.1f} {:14.1f} {:9.1f}x".format(size, legacy / 1024, compact / 1024, legacy / compact))
+
+
+if __name__ == "__main__":
+    main()
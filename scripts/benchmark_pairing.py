@@ -0,0 +1,71 @@
+import argparse
+import datetime
+import os.path
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync import core
+from toggl_to_jira_sync.core import WorklogEntry
+
+ISSUES = ["WEB-1", "WEB-2", "BACK-1", "OPS-1"]
+
+
+def generate_worklogs(count, seed):
+    rnd = random.Random(seed)
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    worklog = []
+    for i in range(count):
+        start += datetime.timedelta(minutes=rnd.randint(10, 90))
+        stop = start + datetime.timedelta(minutes=rnd.randint(5, 120))
+        issue = rnd.choice(ISSUES)
+        worklog.append(WorklogEntry(issue=issue, start=start, stop=stop, comment=issue + " work", tag=i))
+    return worklog
+
+
+def measure(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def all_pairs(toggl_logs, jira_logs):
+    return list(core._calculate_pairing(toggl_logs, jira_logs, core._worklog_entry_distance, core.PAIRING_THRESHOLD))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark worklog pairing")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--all-pairs-limit", type=int, default=1000,
+                        help="largest size the all-pairs reference is run and compared at")
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "entries", "indexed [s]", "per entry", "numpy [s]", "all-pairs [s]"))
+    for size in args.sizes:
+        toggl_logs = generate_worklogs(size, seed=1)
+        jira_logs = generate_worklogs(size, seed=2)
+        indexed = measure(lambda: core.calculate_pairing(toggl_logs, jira_logs, engine="python"))
+        vectorized = "n/a"
+        if core.numpy is not None:
+            vectorized = "{:12.4f}".format(
+                measure(lambda: core.calculate_pairing(toggl_logs, jira_logs, engine="numpy")))
+            assert list(core._calculate_worklog_pairing_numpy(toggl_logs, jira_logs, core.PAIRING_THRESHOLD)) == list(
+                core._calculate_pairing(
+                    toggl_logs, jira_logs, core._worklog_entry_distance, core.PAIRING_THRESHOLD,
+                    max_start_delta=core._max_start_delta(core.PAIRING_THRESHOLD),
+                ))
+        reference = ""
+        if size <= args.all_pairs_limit:
+            reference = "{:12.4f}".format(measure(lambda: all_pairs(toggl_logs, jira_logs)))
+            assert all_pairs(toggl_logs, jira_logs) == list(core._calculate_pairing(
+                toggl_logs, jira_logs, core._worklog_entry_distance, core.PAIRING_THRESHOLD,
+                max_start_delta=core._max_start_delta(core.PAIRING_THRESHOLD),
+            ))
+        print("{:>8} {:12.4f} {:10.2f}us {:>12} {:>12}".format(
+            size, indexed, 1e6 * indexed / size, vectorized, reference))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import datetime
+import os.path
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync import formats
+from toggl_to_jira_sync.formats import datetime_jira_format, datetime_toggl_format
+
+OFFSETS = [-12 * 60, -9 * 60 - 30, -5 * 60, 0, 60, 2 * 60, 5 * 60 + 45, 9 * 60 + 30, 14 * 60]
+
+
+def generate_datetimes(count, seed):
+    rnd = random.Random(seed)
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    return [
+        (epoch + datetime.timedelta(seconds=rnd.randint(0, 130 * 365 * 24 * 60 * 60),
+                                    milliseconds=rnd.randint(0, 999))).astimezone(
+            datetime.timezone(datetime.timedelta(minutes=rnd.choice(OFFSETS))))
+        for _ in range(count)
+    ]
+
+
+def check_round_trip(datetimes):
+    for dt in datetimes:
+        jira_str = datetime_jira_format.to_str(dt)
+        assert jira_str == datetime_jira_format.to_str_slow(dt), (dt, jira_str)
+        parsed = datetime_jira_format.from_str(jira_str)
+        assert parsed == datetime_jira_format.from_str_slow(jira_str), jira_str
+        assert parsed.utcoffset() == datetime_jira_format.from_str_slow(jira_str).utcoffset(), jira_str
+        assert parsed == dt, (dt, parsed)
+        toggl_str = datetime_toggl_format.to_str(dt)
+        assert datetime_toggl_format.from_str(toggl_str) == dt.replace(microsecond=0), toggl_str
+    for s in ["2020-01-31T12:34:56+0100", "2020-01-31T12:34:56.123456+0100", "2020-01-31T12:34:56.123Z",
+              "2020/01/31T12:34:56.123+0100", "2020-01-31 12:34:56.123+0100", "2020-01-31T12-34-56.123+0100",
+              "2020-01-31T12:34:56,123+0100", "2020-0_-31T12:34:56.123+0100", "2020- 1-31T12:34:56.123+0100"]:
+        try:
+            expected = datetime_jira_format.from_str_slow(s)
+        except ValueError:
+            expected = ValueError
+        try:
+            actual = datetime_jira_format.from_str(s)
+        except ValueError:
+            actual = ValueError
+        assert actual == expected, (s, actual, expected)
+
+
+def measure(fn, values):
+    started = time.perf_counter()
+    for value in values:
+        fn(value)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark timestamp parsing and formatting")
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--check-count", type=int, default=20000,
+                        help="number of random datetimes the fast path is compared against strptime/strftime on")
+    args = parser.parse_args()
+
+    check_round_trip(generate_datetimes(args.check_count, seed=1))
+    print("round trip check of {} datetimes passed".format(args.check_count))
+
+    datetimes = generate_datetimes(args.count, seed=2)
+    jira_strs = [datetime_jira_format.to_str(dt) for dt in datetimes]
+    toggl_strs = [datetime_toggl_format.to_str(dt) for dt in datetimes]
+    cases = [
+        ("jira parse, strptime", datetime_jira_format.from_str_slow, jira_strs),
+        ("jira parse, fixed layout", lambda s: formats._parse_jira.__wrapped__(s), jira_strs),
+        ("jira parse, memo hits", datetime_jira_format.from_str, jira_strs[:formats._MEMO_SIZE] * (
+            args.count // formats._MEMO_SIZE or 1)),
+        ("jira format, strftime", datetime_jira_format.to_str_slow, datetimes),
+        ("jira format, fixed layout", datetime_jira_format.to_str, datetimes),
+        ("toggl parse", datetime_toggl_format.from_str, toggl_strs),
+        ("toggl format", datetime_toggl_format.to_str, datetimes),
+    ]
+    print("{:>26} {:>12} {:>12}".format("case", "total [s]", "per call"))
+    for name, fn, values in cases:
+        seconds = measure(fn, values)
+        print("{:>26} {:12.4f} {:10.3f}us".format(name, seconds, 1e6 * seconds / len(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os.path
+import sys
+import urllib.parse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync import aioapis
+from toggl_to_jira_sync.aioapis import AsyncJiraApi, AsyncTogglApi
+from toggl_to_jira_sync.settingsloader import Secrets
+
+AUTHOR = "john.doe"
+TOGGL_BASE = "https://toggl.example.com/api/"
+JIRA_BASE = "https://jira.example.com/"
+MIN_DATETIME = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+MAX_DATETIME = datetime.datetime(2020, 1, 8, tzinfo=datetime.timezone.utc)
+
+
+class StubServer(object):
+    # answers the requests of the async clients with canned Toggl and Jira responses and records the writes
+    def __init__(self, issue_count, page_size):
+        self.issue_count = issue_count
+        self.page_size = page_size
+        self.writes = []
+
+    def handle(self, request):
+        path = urllib.parse.urlparse(str(request.url)).path
+        params = dict(urllib.parse.parse_qsl(request.url.query.decode()))
+        if request.method != "GET":
+            self.writes.append((request.method, path, json.loads(request.content) if request.content else None))
+            return aioapis.httpx.Response(200, json={})
+        if path == "/api/v8/workspaces":
+            return aioapis.httpx.Response(200, json=[{"id": 1, "name": "My Company"}])
+        if path == "/api/v8/workspaces/1/projects":
+            return aioapis.httpx.Response(200, json=[{"id": 10, "name": "Web Development"}])
+        if path == "/api/v8/time_entries":
+            return aioapis.httpx.Response(200, json=[self._toggl_entry(i) for i in range(self.issue_count)])
+        if path == "/rest/api/2/search":
+            start_at = int(params["startAt"])
+            keys = range(start_at, min(start_at + self.page_size, self.issue_count))
+            return aioapis.httpx.Response(200, json={
+                "total": self.issue_count,
+                "issues": [self._issue(i) for i in keys],
+            })
+        if path.startswith("/rest/api/2/issue/") and path.endswith("/worklog"):
+            i = int(path.split("/")[-2].split("-")[1])
+            return aioapis.httpx.Response(200, json={"worklogs": [self._worklog(i), self._worklog(i, author="x")]})
+        return aioapis.httpx.Response(404)
+
+    @staticmethod
+    def _started(i):
+        return MIN_DATETIME + datetime.timedelta(hours=i)
+
+    def _toggl_entry(self, i):
+        return {
+            "id": i,
+            "uid": 1,
+            "pid": 10,
+            "billable": False,
+            "description": "WEB-{}: work".format(i),
+            "start": self._started(i).isoformat(),
+            "stop": (self._started(i) + datetime.timedelta(minutes=30)).isoformat(),
+        }
+
+    def _issue(self, i):
+        # every other issue carries its complete worklog in the search result
+        worklog = {"total": 1, "maxResults": 20, "worklogs": [self._worklog(i)]}
+        if i % 2:
+            worklog = {"total": 30, "maxResults": 20, "worklogs": []}
+        return {"key": "WEB-{}".format(i), "fields": {"worklog": worklog}}
+
+    def _worklog(self, i, author=AUTHOR):
+        return {
+            "id": "{}{}".format(author, i),
+            "author": {"name": author},
+            "comment": "work",
+            "started": self._started(i).strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+            "timeSpentSeconds": 30 * 60,
+        }
+
+
+async def check(issue_count, page_size):
+    server = StubServer(issue_count, page_size)
+    transport = aioapis.httpx.MockTransport(server.handle)
+    secrets = Secrets({"toggl.apitoken": "token", "jira.username": AUTHOR, "jira.password": "password"})
+    async with AsyncTogglApi(secrets=secrets, api_base=TOGGL_BASE, transport=transport) as toggl_api, \
+            AsyncJiraApi(JIRA_BASE, auth=(AUTHOR, "password"), max_concurrency=4, transport=transport) as jira_api:
+        toggl_worklog, jira_worklog = await asyncio.gather(
+            toggl_api.get_worklog("My Company", min_datetime=MIN_DATETIME, max_datetime=MAX_DATETIME),
+            jira_api.get_worklog(author=AUTHOR, min_datetime=MIN_DATETIME, max_datetime=MAX_DATETIME),
+        )
+        await toggl_api.update(3, {"billable": True})
+        await jira_api.add_entry("WEB-1", {"comment": "work"})
+        await jira_api.delete_entry("WEB-1", "7")
+
+    assert [entry.issue for entry in toggl_worklog["worklog"]] == [
+        "WEB-{}".format(i) for i in range(issue_count)
+    ], toggl_worklog["worklog"]
+    assert all(entry.tag.project_name == "Web Development" for entry in toggl_worklog["worklog"])
+    assert jira_worklog["issues"] == ["WEB-{}".format(i) for i in range(issue_count)], jira_worklog["issues"]
+    assert sorted(entry.tag.id for entry in jira_worklog["worklog"]) == sorted(
+        "{}{}".format(AUTHOR, i) for i in range(issue_count)
+    ), jira_worklog["worklog"]
+    assert jira_worklog["worklog_requests_saved"] == (issue_count + 1) // 2, jira_worklog["worklog_requests_saved"]
+    assert [(method, path) for method, path, _ in server.writes] == [
+        ("PUT", "/api/v8/time_entries/3"),
+        ("POST", "/rest/api/2/issue/WEB-1/worklog"),
+        ("DELETE", "/rest/api/2/issue/WEB-1/worklog/7"),
+    ], server.writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the async Toggl and Jira clients against stubbed responses")
+    parser.add_argument("--issues", type=int, default=25)
+    parser.add_argument("--page-size", type=int, default=10)
+    args = parser.parse_args()
+
+    if aioapis.httpx is None:
+        sys.exit("httpx is not installed, the async clients are not available")
+    asyncio.run(check(args.issues, args.page_size))
+    print("async clients check of {} issues passed".format(args.issues))
+
+
+if __name__ == "__main__":
+    main()
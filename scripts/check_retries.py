@@ -0,0 +1,118 @@
+import argparse
+import json
+import os.path
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync import transport
+from toggl_to_jira_sync.apis import JiraApi
+from toggl_to_jira_sync.transport import RetryPolicy
+
+
+class StubJira(object):
+    # rejects the first GETs of a worklog with 429 and every POST with 503, and records when each request came in
+    def __init__(self, throttled_count, retry_after):
+        self.throttled_count = throttled_count
+        self.retry_after = retry_after
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def handle(self, method, path):
+        with self.lock:
+            self.requests.append((method, path, time.monotonic()))
+            count = sum(1 for m, p, _ in self.requests if (m, p) == (method, path))
+        if method == "POST":
+            return 503, {}, {"errorMessages": ["Service unavailable"]}
+        if count <= self.throttled_count:
+            return 429, {"Retry-After": str(self.retry_after)}, {"errorMessages": ["Rate limit exceeded"]}
+        return 200, {}, {"id": "7", "comment": "work"}
+
+
+def serve(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._answer()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._answer()
+
+        def _answer(self):
+            status, headers, body = stub.handle(self.command, self.path.split("?")[0])
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_retries(throttled_count, retry_after):
+    stub = StubJira(throttled_count, retry_after)
+    server = serve(stub)
+    try:
+        api = JiraApi(
+            "http://127.0.0.1:{}/".format(server.server_address[1]),
+            retry_policy=RetryPolicy(max_retries=5, backoff_base=0.01),
+        )
+        started = time.monotonic()
+        worklog = api.get_entry("WEB-1", "7")
+        elapsed = time.monotonic() - started
+        assert worklog["id"] == "7", worklog
+        assert len(stub.requests) == throttled_count + 1, stub.requests
+        expected = throttled_count * retry_after
+        assert expected - 0.1 <= elapsed < expected + 0.5, elapsed
+
+        # a failed POST may have been applied, it is not sent again
+        del stub.requests[:]
+        try:
+            api.add_entry("WEB-1", {"comment": "work"})
+        except requests.HTTPError as e:
+            assert e.response.status_code == 503, e.response.status_code
+        else:
+            raise AssertionError("the 503 of the POST was not raised")
+        assert [(method, path) for method, path, _ in stub.requests] == [
+            ("POST", "/rest/api/2/issue/WEB-1/worklog"),
+        ], stub.requests
+        return elapsed
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def check_rate_limiters():
+    limiter = transport.get_rate_limiter("https://jira.example.com/", 10, burst=5)
+    assert transport.get_rate_limiter("https://jira.example.com/rest/", 10, burst=5) is limiter
+    assert transport.get_rate_limiter("https://jira.example.com/", 20, burst=5) is not limiter
+    assert transport.get_rate_limiter("https://jira.example.com/", 10, burst=1) is not limiter
+    assert transport.get_rate_limiter("https://jira.example.com/", None) is None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the retries of the Jira client against a throttling stub")
+    parser.add_argument("--throttled", type=int, default=2)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    elapsed = check_retries(args.throttled, args.retry_after)
+    check_rate_limiters()
+    print("retry check passed, {} throttled requests retried after {:.2f}s".format(args.throttled, elapsed))
+
+
+if __name__ == "__main__":
+    main()
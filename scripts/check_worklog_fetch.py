@@ -0,0 +1,160 @@
+import argparse
+import datetime
+import json
+import os.path
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync.apis import JiraApi, JiraWorklogFilter, WorklogFetchError
+
+AUTHOR = "john.doe"
+MIN_DATETIME = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+MAX_DATETIME = datetime.datetime(2020, 1, 8, tzinfo=datetime.timezone.utc)
+
+
+class StubJira(object):
+    # serves search pages without embedded worklogs and answers every worklog request after a fixed latency
+    def __init__(self, issue_count, page_size, latency, failing=()):
+        self.issue_count = issue_count
+        self.page_size = page_size
+        self.latency = latency
+        self.failing = set(failing)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handle(self, path, params):
+        if path == "/rest/api/2/search":
+            start_at = int(params["startAt"])
+            keys = range(start_at, min(start_at + self.page_size, self.issue_count))
+            return 200, {"total": self.issue_count, "issues": [self._issue(i) for i in keys]}
+        if path.startswith("/rest/api/2/issue/") and path.endswith("/worklog"):
+            i = int(path.split("/")[-2].split("-")[1])
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                time.sleep(self.latency)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+            if i in self.failing:
+                return 404, {"errorMessages": ["Issue does not exist"]}
+            return 200, {"worklogs": [self._worklog(i)]}
+        return 404, {}
+
+    @staticmethod
+    def _issue(i):
+        return {"key": "WEB-{}".format(i), "fields": {"worklog": {"total": 30, "maxResults": 20, "worklogs": []}}}
+
+    @staticmethod
+    def _worklog(i):
+        return {
+            "id": str(i),
+            "author": {"name": AUTHOR},
+            "comment": "work",
+            "started": (MIN_DATETIME + datetime.timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%S.000+0000"),
+            "timeSpentSeconds": 30 * 60,
+        }
+
+
+def serve(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            status, body = stub.handle(url.path, dict(urllib.parse.parse_qsl(url.query)))
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(stub, max_concurrency):
+    server = serve(stub)
+    try:
+        api = JiraApi("http://127.0.0.1:{}/".format(server.server_address[1]), max_concurrency=max_concurrency)
+        started = time.perf_counter()
+        result = api.get_worklog(author=AUTHOR, min_datetime=MIN_DATETIME, max_datetime=MAX_DATETIME)
+        return result, time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def check_read_ahead(stub, max_concurrency, max_in_flight):
+    # the search pages are only read as far as the in-flight bound allows
+    server = serve(stub)
+    try:
+        api = JiraApi("http://127.0.0.1:{}/".format(server.server_address[1]), max_concurrency=max_concurrency)
+        worklog_filter = JiraWorklogFilter(author=AUTHOR, min_date=MIN_DATETIME, max_date=MAX_DATETIME)
+        read = [0]
+
+        def issues():
+            for issue in api.execute_jql("", fields=["key", "worklog"], page_size=stub.page_size):
+                read[0] += 1
+                yield issue
+
+        keys = []
+        for issue_worklog in api._iter_issue_worklogs(issues(), worklog_filter, max_in_flight=max_in_flight):
+            keys.append(issue_worklog.issue_key)
+            assert read[0] - len(keys) < max_in_flight, (read[0], len(keys))
+        assert keys == ["WEB-{}".format(i) for i in range(stub.issue_count)], keys
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch Jira worklogs from a stub server with artificial latency")
+    parser.add_argument("--issues", type=int, default=40)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    keys = ["WEB-{}".format(i) for i in range(args.issues)]
+
+    sequential_stub = StubJira(args.issues, args.page_size, args.latency)
+    sequential, sequential_time = run(sequential_stub, max_concurrency=1)
+    assert sequential_stub.max_in_flight == 1, sequential_stub.max_in_flight
+
+    concurrent_stub = StubJira(args.issues, args.page_size, args.latency)
+    concurrent, concurrent_time = run(concurrent_stub, max_concurrency=args.max_concurrency)
+    assert concurrent_stub.max_in_flight <= args.max_concurrency, concurrent_stub.max_in_flight
+    assert concurrent["issues"] == keys, concurrent["issues"]
+    assert [entry.tag.id for entry in concurrent["worklog"]] == [entry.tag.id for entry in sequential["worklog"]]
+    assert concurrent_time * 3 < sequential_time, (concurrent_time, sequential_time)
+
+    failing = [3, args.issues - 1]
+    try:
+        run(StubJira(args.issues, args.page_size, args.latency, failing=failing), max_concurrency=args.max_concurrency)
+    except WorklogFetchError as e:
+        assert list(e.errors) == ["WEB-{}".format(i) for i in failing], list(e.errors)
+    else:
+        raise AssertionError("failing issues were not reported")
+
+    read_ahead_stub = StubJira(args.issues, args.page_size, args.latency)
+    check_read_ahead(read_ahead_stub, args.max_concurrency, 2 * args.max_concurrency)
+
+    print("{:>12} {:>12} {:>14}".format("concurrency", "total [s]", "max in flight"))
+    print("{:>12} {:>12.4f} {:>14}".format(1, sequential_time, sequential_stub.max_in_flight))
+    print("{:>12} {:>12.4f} {:>14}".format(args.max_concurrency, concurrent_time, concurrent_stub.max_in_flight))
+    print("worklog fetch check of {} issues passed".format(args.issues))
+
+
+if __name__ == "__main__":
+    main()
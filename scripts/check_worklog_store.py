@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import json
+import os.path
+import sys
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+from toggl_to_jira_sync.formats import datetime_jira_format
+from toggl_to_jira_sync.worklog_store import IncrementalJiraApi, JiraWorklogStore
+
+AUTHOR = "john.doe"
+WEEK_0 = datetime.datetime(2019, 12, 30, tzinfo=datetime.timezone.utc)
+WEEK_1 = WEEK_0 + datetime.timedelta(days=7)
+WEEK_2 = WEEK_1 + datetime.timedelta(days=7)
+FULL_FETCH_PATHS = {"/rest/api/2/search"}
+DELTA_PATHS = {"/rest/api/2/worklog/updated", "/rest/api/2/worklog/deleted", "/rest/api/2/worklog/list"}
+
+
+class StubJira(object):
+    # serves two weeks of worklogs of a few issues, the feeds report the changes made with update and delete
+    def __init__(self, issue_count):
+        self.issue_count = issue_count
+        self.worklogs = dict()
+        for i in range(issue_count):
+            for day in range(14):
+                worklog_id = str(100 * i + day)
+                self.worklogs[worklog_id] = {
+                    "id": worklog_id,
+                    "issueId": str(1000 + i),
+                    "author": {"name": AUTHOR},
+                    "comment": "work",
+                    "started": (WEEK_0 + datetime.timedelta(days=day, hours=i)).strftime(
+                        "%Y-%m-%dT%H:%M:%S.000+0000"),
+                    "timeSpentSeconds": 30 * 60,
+                }
+        self.updated = []
+        self.deleted = []
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def update(self, worklog_id, comment):
+        self.worklogs[worklog_id]["comment"] = comment
+        self.updated.append(worklog_id)
+
+    def delete(self, worklog_id):
+        del self.worklogs[worklog_id]
+        self.deleted.append(worklog_id)
+
+    def take_requests(self):
+        with self.lock:
+            requests, self.requests = self.requests, []
+        return requests
+
+    def handle(self, method, path, params, body):
+        with self.lock:
+            self.requests.append(path)
+        if path == "/rest/api/2/search":
+            start_at = int(params["startAt"])
+            keys = range(start_at, min(start_at + int(params["maxResults"]), self.issue_count))
+            return {"total": self.issue_count, "issues": [self._issue(i) for i in keys]}
+        if path.startswith("/rest/api/2/issue/") and path.endswith("/worklog"):
+            i = int(path.split("/")[-2].split("-")[1])
+            return {"worklogs": [w for w in self.worklogs.values() if w["issueId"] == str(1000 + i)]}
+        if path == "/rest/api/2/worklog/updated":
+            return self._feed(self.updated)
+        if path == "/rest/api/2/worklog/deleted":
+            return self._feed(self.deleted)
+        if path == "/rest/api/2/worklog/list" and method == "POST":
+            return [self.worklogs[str(worklog_id)] for worklog_id in body["ids"] if str(worklog_id) in self.worklogs]
+        return None
+
+    @staticmethod
+    def _issue(i):
+        return {"key": "WEB-{}".format(i), "fields": {"worklog": {"total": 30, "maxResults": 20, "worklogs": []}}}
+
+    @staticmethod
+    def _feed(ids):
+        until = int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+        return {"values": [{"worklogId": int(worklog_id)} for worklog_id in ids], "until": until, "lastPage": True}
+
+
+def serve(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._answer(None)
+
+        def do_POST(self):
+            self._answer(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+
+        def _answer(self, body):
+            url = urllib.parse.urlparse(self.path)
+            result = stub.handle(self.command, url.path, dict(urllib.parse.parse_qsl(url.query)), body)
+            data = json.dumps(result).encode()
+            self.send_response(404 if result is None else 200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check(issue_count):
+    stub = StubJira(issue_count)
+    server = serve(stub)
+    try:
+        api = IncrementalJiraApi(
+            "http://127.0.0.1:{}/".format(server.server_address[1]),
+            max_concurrency=4,
+            store=JiraWorklogStore(),
+        )
+
+        def fetch(min_datetime, max_datetime):
+            result = api.get_worklog(author=AUTHOR, min_datetime=min_datetime, max_datetime=max_datetime)
+            comments = {entry.tag.id: entry.comment for entry in result["worklog"]}
+            expected = {
+                worklog_id: worklog["comment"]
+                for worklog_id, worklog in stub.worklogs.items()
+                if min_datetime <= datetime_jira_format.from_str_slow(worklog["started"]) < max_datetime
+            }
+            assert comments == expected, (comments, expected)
+            return result, set(stub.take_requests())
+
+        result, paths = fetch(WEEK_1, WEEK_2)
+        assert not result["incremental"] and FULL_FETCH_PATHS <= paths, paths
+
+        stub.update("101", "updated")
+        stub.delete("7")
+        result, paths = fetch(WEEK_1, WEEK_2)
+        assert result["incremental"] and paths <= DELTA_PATHS, paths
+
+        # the previous week is fetched in full, the week fetched before is only brought up to date
+        stub.update("8", "updated again")
+        result, paths = fetch(WEEK_0, WEEK_1)
+        assert not result["incremental"] and FULL_FETCH_PATHS <= paths, paths
+
+        # going back and forth between the weeks, or over both, only reads the feeds
+        stub.delete("9")
+        for min_datetime, max_datetime in [(WEEK_1, WEEK_2), (WEEK_0, WEEK_1), (WEEK_0, WEEK_2)]:
+            result, paths = fetch(min_datetime, max_datetime)
+            assert result["incremental"] and paths <= DELTA_PATHS, paths
+        assert api.store.ranges == [(WEEK_0, WEEK_2)], api.store.ranges
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the incremental Jira worklog sync against a stub server")
+    parser.add_argument("--issues", type=int, default=5)
+    args = parser.parse_args()
+
+    check(args.issues)
+    print("incremental worklog sync check of {} issues passed".format(args.issues))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3 @@
+#!/usr/bin/env sh
+source venv/bin/activate
+gunicorn --workers "${WORKERS:-4}" --threads "${THREADS:-8}" --bind "${BIND:-127.0.0.1:5000}" wsgi:application
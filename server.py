@@ -4,7 +4,12 @@ import sys
 
 logging.basicConfig(level=logging.DEBUG)
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
-from toggl_to_jira_sync import app
+from toggl_to_jira_sync import application
+
+app = application.app
 
 if __name__ == "__main__":
-    app.main()
+    application.main()
+else:
+    # flask run (run-once, debug) imports this module as FLASK_APP without running main
+    application.configure()
@@ -1,7 +1,6 @@
 import logging
 from collections import namedtuple
 
-from toggl_to_jira_sync import utils
 from toggl_to_jira_sync.formats import datetime_toggl_format, datetime_jira_format
 
 logger = logging.getLogger(__name__)
@@ -90,8 +89,7 @@ class ActionRecorder(object):
 
 
 class DiffGather(object):
-    def __init__(self, settings, projects):
-        toggl_projects_by_name = utils.index_by(projects, "name")
+    def __init__(self, settings, toggl_projects_by_name):
         self.toggl_projects_by_key = dict()
         for k, v in settings.projects.items():
             project = None
@@ -196,7 +194,7 @@ def _gather_diff(recorder, toggl, jira, diff_params):
         if equals_by is None:
             equals_by = _identity
 
-        actual = jira.tag.raw_entry.get(fieldname)
+        actual = jira.tag.raw_fields.get(fieldname)
         expected = expected_jira[fieldname]
         if equals_by(actual) != equals_by(expected):
             logger.info("Jira field %s differs, actual: %s expected: %s", fieldname, actual, expected)
@@ -0,0 +1,275 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+from collections import OrderedDict
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from toggl_to_jira_sync import settingsloader, dicts, service, transport
+from toggl_to_jira_sync.apis import JiraApi, JiraWorklogFilter, TogglApi, WorklogFetchError
+from toggl_to_jira_sync.metadata_cache import toggl_metadata_cache, create_toggl_metadata
+
+logger = logging.getLogger(__name__)
+
+
+def _require_httpx():
+    if httpx is None:
+        raise RuntimeError("The async clients need httpx installed")
+
+
+class AsyncBaseApi(object):
+    def __init__(self, client, api_base, rate_limiter=None, retry_policy=None):
+        if retry_policy is None:
+            retry_policy = transport.RetryPolicy()
+        self.client = client
+        self.api_base = api_base
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+
+    async def _request(self, method, url, params=None, json=None):
+        logger.debug("Api call %s %s %s %s", method, url, params, json)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                await asyncio.sleep(self.rate_limiter.reserve())
+            try:
+                resp = await self.client.request(method, self.api_base + url, params=params, json=json)
+            except httpx.TransportError as e:
+                if not self.retry_policy.should_retry(method, None, attempt):
+                    raise
+                delay = self.retry_policy.delay_of(attempt)
+                logger.info("Retrying %s %s in %.1fs after %s", method, url, delay, e)
+            else:
+                if not self.retry_policy.should_retry(method, resp.status_code, attempt):
+                    break
+                delay = self.retry_policy.delay_of(attempt, resp)
+                logger.info("Retrying %s %s in %.1fs after status %s", method, url, delay, resp.status_code)
+            await asyncio.sleep(delay)
+            attempt += 1
+        try:
+            resp.raise_for_status()
+        except:
+            logger.debug(resp.text)
+            raise
+        if resp.text:
+            return resp.json()
+        return None
+
+    async def _get(self, url, params=None):
+        return await self._request("get", url, params=params)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class AsyncTogglApi(AsyncBaseApi):
+    def __init__(self, secrets=None, api_base=None, metadata_ttl=None, max_connections=None,
+                 rate_limiter=None, retry_policy=None, transport=None):
+        _require_httpx()
+        if api_base is None:
+            api_base = "https://www.toggl.com/api/"
+        if metadata_ttl is None:
+            metadata_ttl = 60 * 60
+        if secrets is None:
+            secrets = settingsloader.get_secrets()
+        client = httpx.AsyncClient(
+            auth=(secrets.toggl_apitoken, "api_token"),
+            limits=httpx.Limits(max_connections=max_connections),
+            transport=transport,
+        )
+        super().__init__(client, api_base, rate_limiter=rate_limiter, retry_policy=retry_policy)
+        self.metadata_ttl = metadata_ttl
+        self.cache_namespace = "toggl {} {}".format(
+            api_base,
+            hashlib.sha256(secrets.toggl_apitoken.encode()).hexdigest(),
+        )
+
+    async def get_projects(self, workspace_id):
+        return await self._get("v8/workspaces/{workspace_id}/projects".format(workspace_id=workspace_id))
+
+    async def get_workspaces(self):
+        return await self._get("v8/workspaces")
+
+    async def get_entries(self, start_datetime=None, end_datetime=None):
+        return await self._get("v8/time_entries", params=TogglApi._entries_params(start_datetime, end_datetime))
+
+    async def get_metadata(self, workspace_name):
+        workspace_key = ("workspace", self.cache_namespace, workspace_name)
+        workspace = toggl_metadata_cache.lookup(workspace_key)
+        if workspace is None:
+            workspace = dicts.find_first(await self.get_workspaces(), name=workspace_name)
+            toggl_metadata_cache.store(workspace_key, workspace, self.metadata_ttl)
+        projects_key = ("projects", self.api_base, workspace["id"])
+        metadata = toggl_metadata_cache.lookup(projects_key)
+        if metadata is None:
+            metadata = create_toggl_metadata(workspace, await self.get_projects(workspace["id"]))
+            toggl_metadata_cache.store(projects_key, metadata, self.metadata_ttl)
+        return metadata
+
+    async def get_worklog(self, workspace_name, min_datetime=None, max_datetime=None):
+        metadata, entries = await asyncio.gather(
+            self.get_metadata(workspace_name),
+            self.get_entries(start_datetime=min_datetime, end_datetime=max_datetime),
+        )
+        return TogglApi._worklog_result(metadata, entries, min_datetime, max_datetime)
+
+    async def update(self, id, data):
+        await self._request(
+            "put",
+            "v8/time_entries/{id}".format(id=id),
+            json={"time_entry": TogglApi._entry_data(data)},
+        )
+
+    async def bulk_update(self, ids, data):
+        return await self._request(
+            "put",
+            "v8/time_entries/{ids}".format(ids=",".join(str(id) for id in ids)),
+            json={"time_entry": TogglApi._entry_data(data)},
+        )
+
+
+class AsyncJiraApi(AsyncBaseApi):
+    def __init__(self, api_base, auth=None, max_concurrency=None, rate_limiter=None, retry_policy=None,
+                 transport=None):
+        _require_httpx()
+        if max_concurrency is None:
+            max_concurrency = 8
+        client = httpx.AsyncClient(
+            auth=auth,
+            limits=httpx.Limits(max_connections=max_concurrency),
+            transport=transport,
+        )
+        super().__init__(client, api_base, rate_limiter=rate_limiter, retry_policy=retry_policy)
+        self.max_concurrency = max_concurrency
+
+    async def get_worklog(self, author=None, min_datetime=None, max_datetime=None):
+        worklog_filter = JiraWorklogFilter(author=author, min_date=min_datetime, max_date=max_datetime)
+        jql = JiraApi._assemble_jql(worklog_filter, date_error_margin=datetime.timedelta(days=1))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        issue_keys = []
+        tasks = []
+        requests_saved = 0
+        try:
+            async for issue in self.execute_jql(jql, fields=["key", "worklog"]):
+                issue_keys.append(issue["key"])
+                if JiraApi._get_complete_embedded_worklogs(issue) is not None:
+                    requests_saved += 1
+                tasks.append(asyncio.ensure_future(self._fetch_worklog_list(worklog_filter, issue, semaphore)))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        worklog = []
+        errors = OrderedDict()
+        for issue_key, result in zip(issue_keys, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to fetch worklog of issue %s: %s", issue_key, result)
+                errors[issue_key] = result
+            else:
+                worklog.extend(result)
+        if errors:
+            raise WorklogFetchError(errors)
+        logger.info("Embedded worklogs saved %d of %d worklog requests", requests_saved, len(issue_keys))
+        return {
+            "jql": jql,
+            "worklog_filter": worklog_filter,
+            "issues": issue_keys,
+            "worklog": worklog,
+            "worklog_requests_saved": requests_saved,
+        }
+
+    async def execute_jql(self, jql, fields=None, page_size=None):
+        if fields is None:
+            fields = ["key"]
+        if page_size is None:
+            page_size = 100
+        start_at = 0
+        while True:
+            params = JiraApi._search_params(jql, fields, start_at, page_size)
+            resp = await self._get("rest/api/2/search", params=params)
+            issues = resp["issues"]
+            for issue in issues:
+                yield issue
+            start_at += len(issues)
+            if not issues or start_at >= resp["total"]:
+                return
+
+    async def _fetch_worklog_list(self, worklog_filter, issue, semaphore):
+        worklogs = JiraApi._get_complete_embedded_worklogs(issue)
+        if worklogs is None:
+            async with semaphore:
+                resp = await self._get("rest/api/2/issue/{key}/worklog".format(key=issue["key"]))
+            worklogs = resp["worklogs"]
+        return list(JiraApi._extract_worklogs(worklog_filter, issue, worklogs))
+
+    async def delete_entry(self, issue, worklog_id):
+        await self._request(
+            "delete",
+            "rest/api/2/issue/{issue}/worklog/{worklog_id}".format(
+                issue=issue,
+                worklog_id=worklog_id,
+            ))
+
+    async def update_entry(self, issue, worklog_id, data):
+        await self._request(
+            "put",
+            "rest/api/2/issue/{issue}/worklog/{worklog_id}".format(
+                issue=issue,
+                worklog_id=worklog_id,
+            ),
+            json=data
+        )
+
+    async def add_entry(self, issue, data):
+        await self._request(
+            "post",
+            "rest/api/2/issue/{issue}/worklog".format(issue=issue),
+            json=data
+        )
+
+
+def create_async_apis(secrets=None, settings=None):
+    if secrets is None:
+        secrets = settingsloader.get_secrets()
+    if settings is None:
+        settings = settingsloader.get_settings()
+    retry_policy = service.create_retry_policy(settings)
+    toggl_api = AsyncTogglApi(
+        secrets=secrets,
+        api_base=settings.toggl_url_base,
+        metadata_ttl=settings.toggl_metadata_ttl,
+        rate_limiter=transport.get_rate_limiter(
+            settings.toggl_url_base,
+            settings.toggl_requests_per_second,
+            burst=settings.toggl_requests_burst,
+        ),
+        retry_policy=retry_policy,
+    )
+    jira_api = AsyncJiraApi(
+        api_base=settings.jira_url_base,
+        auth=(secrets.jira_username, secrets.jira_password),
+        max_concurrency=settings.jira_max_concurrency,
+        rate_limiter=transport.get_rate_limiter(
+            settings.jira_url_base,
+            settings.jira_requests_per_second,
+            burst=settings.jira_requests_burst,
+        ),
+        retry_policy=retry_policy,
+    )
+    return service.SecretsAndApis(
+        toggl=toggl_api,
+        jira=jira_api,
+        secrets=secrets,
+        settings=settings,
+    )
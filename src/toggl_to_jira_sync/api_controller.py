@@ -4,7 +4,9 @@ import time
 
 import flask
 
-from . import api_service, service, settingsloader
+from . import api_service, scheduler, service, settingsloader
+from .core import DayBin
+from .day_models import get_model_cache
 
 
 def api_routes(app):
@@ -15,34 +17,87 @@ def api_routes(app):
             "jira_username": secret.jira_username
         })
 
+    @app.route("/api/entries/toggl/<int:entry_id>", methods=["GET"])
+    def api_get_toggl_entry(entry_id):
+        return flask.jsonify(service.get_apis().toggl.get_entry(entry_id))
+
+    @app.route("/api/entries/jira/<issue>/<worklog_id>", methods=["GET"])
+    def api_get_jira_entry(issue, worklog_id):
+        return flask.jsonify(service.get_apis().jira.get_entry(issue, worklog_id))
+
     @app.route("/api/diff", methods=["GET"])
     def api_get_diff():
         date_max, date_min = _get_date_args()
 
-        result = api_service.inspect_interval(date_min, date_max)
+        # refresh skips the precomputed diff, e.g. right after a sync
+        snapshot = scheduler.get_snapshot(date_min, date_max) if not _get_flag_arg("refresh", False) else None
+        if snapshot is not None:
+            result = api_service.restrict_to_interval(snapshot.result, date_min, date_max)
+            age = time.time() - snapshot.computed_at
+        else:
+            result = api_service.inspect_interval(date_min, date_max)
+            age = 0.0
         aggregated_actions = [
             action
             for row in result["rows"]
             for action in row["actions"]
         ]
-        return flask.jsonify(_format_day(aggregated_actions, date_max, date_min, result))
+        return flask.jsonify(dict(_format_day(aggregated_actions, date_max, date_min, result), age=age))
+
+    @app.route("/api/diff/stream", methods=["GET"])
+    def api_stream_diff():
+        date_max, date_min = _get_date_args()
+        include_projects = _get_flag_arg("projects")
+        include_entries = _get_flag_arg("entries")
+        snapshot = scheduler.get_snapshot(date_min, date_max) if not _get_flag_arg("refresh", False) else None
+        apis = service.get_apis() if snapshot is None else None
+        def _stream():
+            yield {"type": "header", "date_min": _format_date(date_min), "date_max": _format_date(date_max)}
+            # every DayBin day is fetched and paired on its own and sent as soon as it is done, the days break at the
+            # same turnover as the days of the dashboard, so they pair the same
+            for i, (_, day_min, day_max) in enumerate(_day_bins(date_min, date_max, DayBin())):
+                if snapshot is not None:
+                    day_result = api_service.restrict_to_interval(snapshot.result, day_min, day_max)
+                else:
+                    day_result = api_service.inspect_interval(day_min, day_max, apis=apis)
+                if include_projects and i == 0:
+                    yield {"type": "projects", "projects": day_result["projects"]}
+                for row in day_result["rows"]:
+                    yield dict(_format_row(row), type="row")
+                day = {
+                    "type": "day",
+                    "date_min": _format_date(day_min),
+                    "date_max": _format_date(day_max),
+                    "actions": [action for row in day_result["rows"] for action in row["actions"]],
+                    "timings": day_result["timings"],
+                }
+                if include_entries:
+                    day["entry_ids"] = _entry_ids(day_result["rows"])
+                yield day
+            age = time.time() - snapshot.computed_at if snapshot is not None else 0.0
+            yield {"type": "end", "age": age}
+        return flask.Response(
+            _json_lines(_stream()), mimetype="text/plain"
+        )
 
     @app.route("/api/diff/sync", methods=["POST"])
     def api_sync_diff():
         date_max, date_min = _get_date_args()
-        result = api_service.inspect_interval(date_min, date_max)
-        aggregated_actions = [
-            action
-            for row in result["rows"]
-            for action in row["actions"]
-        ]
-        action_executor = service.ActionExecutor()
-        total = len(aggregated_actions)
+        apis = service.get_apis()
+        result = api_service.inspect_interval(date_min, date_max, apis=apis)
+        action_groups = [row["actions"] for row in result["rows"]]
+        action_executor = service.ActionExecutor(apis=apis)
+        total = sum(len(action_group) for action_group in action_groups)
         def _stream():
-            for i, action in enumerate(aggregated_actions):
-                yield {"current": i, "total": total, "next": aggregated_actions[i], "finished": False}
-                action_executor.execute(action)
-            yield {"current": total, "total": total, "next": None, "finished": True}
+            yield {"current": 0, "total": total, "done": None, "error": None, "finished": False}
+            try:
+                for i, progress in enumerate(action_executor.execute_groups(action_groups), 1):
+                    error = str(progress.error) if progress.error is not None else None
+                    yield {"current": i, "total": total, "done": progress.action, "error": error, "finished": False}
+            finally:
+                # the cached days and the precomputed diff predate the sync, also when it was cut off
+                _invalidate_synced_days(apis, date_min, date_max)
+            yield {"current": total, "total": total, "done": None, "error": None, "finished": True}
         return flask.Response(
             _json_lines(_stream()), mimetype="text/plain"
         )
@@ -74,23 +129,55 @@ def _get_date_args():
     return date_max, date_min
 
 
+def _get_flag_arg(name, default=True):
+    value = flask.request.args.get(name, None)
+    if value is None:
+        return default
+    return value.lower() not in ("0", "false", "no")
+
+
+def _day_bins(date_min, date_max, day_bin):
+    # the DayBin days overlapping the range, each with its part of the range
+    date = day_bin.date_of(date_min)
+    while day_bin.start_datetime_of(date) < date_max:
+        yield date, max(day_bin.start_datetime_of(date), date_min), min(day_bin.end_datetime_of(date), date_max)
+        date += datetime.timedelta(days=1)
+
+
+def _invalidate_synced_days(apis, date_min, date_max):
+    model_cache = get_model_cache(apis.settings)
+    for date, _, _ in _day_bins(date_min, date_max, DayBin()):
+        model_cache.invalidate(user=apis.secrets.jira_username, day=date)
+    scheduler.invalidate()
+
+
+def _entry_ids(rows):
+    # the raw Toggl entries are not kept, they are served by /api/entries/toggl/<id>
+    return [row["toggl"].tag.id for row in rows if row["toggl"] is not None]
+
+
 def _format_day(aggregated_actions, date_max, date_min, result):
     return {
         "date_min": _format_date(date_min),
         "date_max": _format_date(date_max),
         "actions": aggregated_actions,
-        "rows": [{
-            "actions": row["actions"],
-            "toggl": _format_toggl(row.get("toggl")),
-            "jira": _format_jira(row.get("jira")),
-            "messages": [{
-                "text": m.message,
-                "level": m.level
-            } for m in row["messages"]],
-            "dist": row["dist"],
-        } for row in result["rows"]],
+        "rows": [_format_row(row) for row in result["rows"]],
         "projects": result["projects"],
-        "entries": result["entries"],
+        "entry_ids": _entry_ids(result["rows"]),
+        "timings": result["timings"],
+    }
+
+
+def _format_row(row):
+    return {
+        "actions": row["actions"],
+        "toggl": _format_toggl(row.get("toggl")),
+        "jira": _format_jira(row.get("jira")),
+        "messages": [{
+            "text": m.message,
+            "level": m.level
+        } for m in row["messages"]],
+        "dist": row["dist"],
     }
 
 
@@ -1,24 +1,42 @@
-from . import settingsloader, service, actions
-from .core import calculate_pairing
+import datetime
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+from . import service, actions
+from .core import DayBin, calculate_pairing
 
-def inspect_interval(min_datetime, max_datetime):
-    settings = settingsloader.get_settings()
-    apis = service.get_apis(settings=settings)
+
+def get_window(delta, day_bin=None):
+    if day_bin is None:
+        day_bin = DayBin()
+    today = day_bin.date_of(service.aware_now())
+    min_datetime = day_bin.start_datetime_of(today) + datetime.timedelta(days=delta - 7)
+    max_datetime = day_bin.end_datetime_of(today) + datetime.timedelta(days=delta)
+    return min_datetime, max_datetime
+
+
+def get_window_dates(delta, day_bin=None):
+    if day_bin is None:
+        day_bin = DayBin()
+    today = day_bin.date_of(service.aware_now())
+    return [today + datetime.timedelta(days=delta - i) for i in range(8)]
+
+
+def inspect_interval(min_datetime, max_datetime, apis=None):
+    if apis is None:
+        apis = service.get_apis()
+    settings = apis.settings
     if apis.secrets is None:
         raise RuntimeError("Secrets not set up")
-    jira_worklog = apis.jira.get_worklog(
-        author=apis.secrets.jira_username,
-        min_datetime=min_datetime,
-        max_datetime=max_datetime,
-    )
-    toggl_worklog = apis.toggl.get_worklog(
-        workspace_name=settings.toggl_workspace_name,
-        min_datetime=min_datetime,
-        max_datetime=max_datetime,
+    worklogs = fetch_worklogs(apis, min_datetime, max_datetime)
+    toggl_worklog = worklogs.toggl
+    jira_worklog = worklogs.jira
+    pairings = calculate_pairing(toggl_worklog["worklog"], jira_worklog["worklog"], engine=settings.pairing_engine)
+    diff_gatherer = actions.DiffGather(
+        settings=settings,
+        toggl_projects_by_name=toggl_worklog["metadata"].projects_by_name,
     )
-    pairings = calculate_pairing(toggl_worklog["worklog"], jira_worklog["worklog"])
-    diff_gatherer = actions.DiffGather(settings=settings, projects=toggl_worklog["projects"])
     rows = [
         determine_actions_and_map(pairing, diff_gatherer)
         for pairing in pairings
@@ -26,10 +44,55 @@ def inspect_interval(min_datetime, max_datetime):
     return dict(
         rows=rows,
         projects=toggl_worklog["projects"],
-        entries=toggl_worklog["entries"],
+        timings=worklogs.timings,
     )
 
 
+def restrict_to_interval(result, min_datetime, max_datetime):
+    return dict(result, rows=[
+        row
+        for row in result["rows"]
+        if min_datetime <= row["start"] < max_datetime
+    ])
+
+
+FetchedWorklogs = namedtuple("FetchedWorklogs", ["toggl", "jira", "timings"])
+
+
+def fetch_worklogs(apis, min_datetime, max_datetime):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        jira_future = executor.submit(
+            _timed,
+            apis.jira.get_worklog,
+            author=apis.secrets.jira_username,
+            min_datetime=min_datetime,
+            max_datetime=max_datetime,
+        )
+        toggl_future = executor.submit(
+            _timed,
+            apis.toggl.get_worklog,
+            workspace_name=apis.settings.toggl_workspace_name,
+            min_datetime=min_datetime,
+            max_datetime=max_datetime,
+        )
+        jira_worklog, jira_seconds = jira_future.result()
+        toggl_worklog, toggl_seconds = toggl_future.result()
+    return FetchedWorklogs(
+        toggl=toggl_worklog,
+        jira=jira_worklog,
+        timings={
+            "toggl": toggl_seconds,
+            "jira": jira_seconds,
+        },
+    )
+
+
+def _timed(fn, **kwargs):
+    started = time.monotonic()
+    result = fn(**kwargs)
+    return result, time.monotonic() - started
+
+
 def determine_actions_and_map(pairing, diff_gatherer):
     diff = diff_gatherer.gather_diff(pairing)
     return {
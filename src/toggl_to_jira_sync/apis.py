@@ -1,6 +1,10 @@
 import datetime
+import hashlib
 import logging
-from collections import namedtuple
+import sys
+import time
+from collections import deque, namedtuple, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import requests
 from requests.auth import HTTPBasicAuth
@@ -9,35 +13,146 @@ from toggl_to_jira_sync import settingsloader
 from toggl_to_jira_sync import utils, dicts
 from toggl_to_jira_sync.core import WorklogEntry
 from toggl_to_jira_sync.formats import datetime_toggl_format, datetime_jira_date_format, datetime_jira_format
+from toggl_to_jira_sync.metadata_cache import toggl_metadata_cache, create_toggl_metadata
+from toggl_to_jira_sync.transport import RetryPolicy, create_session
 
 logger = logging.getLogger(__name__)
 
-JiraTag = namedtuple("JiraTag", ["id", "raw_entry"])
-TogglTag = namedtuple("TogglTag", ["id", "project_name", "project_pid", "billable", "jira_project", "raw_entry"])
+
+class JiraTag(object):
+    # only the raw worklog fields the diff compares are kept, the full worklog can be fetched with get_entry
+    __slots__ = ("id", "raw_fields")
+    RAW_FIELDS = ("started", "timeSpentSeconds", "comment", "issueId")
+
+    def __init__(self, id, raw_entry):
+        self.id = id
+        self.raw_fields = {
+            name: sys.intern(raw_entry[name]) if isinstance(raw_entry.get(name), str) else raw_entry.get(name)
+            for name in self.RAW_FIELDS
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, JiraTag):
+            return NotImplemented
+        return self.id == other.id and self.raw_fields == other.raw_fields
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "JiraTag(id={!r}, raw_fields={!r})".format(self.id, self.raw_fields)
+
+
+class TogglTag(object):
+    __slots__ = ("id", "project_name", "project_pid", "billable", "jira_project")
+
+    def __init__(self, id, project_name, project_pid, billable, jira_project):
+        self.id = id
+        self.project_name = project_name
+        self.project_pid = project_pid
+        self.billable = billable
+        self.jira_project = jira_project
+
+    def _key(self):
+        return self.id, self.project_name, self.project_pid, self.billable, self.jira_project
+
+    def __eq__(self, other):
+        if not isinstance(other, TogglTag):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "TogglTag(id={!r}, project_name={!r}, project_pid={!r}, billable={!r}, jira_project={!r})".format(
+            self.id, self.project_name, self.project_pid, self.billable, self.jira_project)
 
 
 class BaseApi(object):
-    def __init__(self, session, api_base):
+    def __init__(self, session, api_base, cache=None, cache_namespace=None, rate_limiter=None, retry_policy=None):
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
         self.session = session
         self.api_base = api_base
+        self.cache = cache
+        self.cache_namespace = cache_namespace
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
 
     def _request(self, method, url, params=None, json=None):
+        return self._parse(self._send(method, url, params=params, json=json))
+
+    def _send(self, method, url, params=None, json=None, headers=None):
         logger.debug("Api call %s %s %s %s", method, url, params, json)
-        resp = self.session.request(
-            method,
-            self.api_base + url,
-            params=params,
-            json=json,
-        )
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                resp = self.session.request(
+                    method,
+                    self.api_base + url,
+                    params=params,
+                    json=json,
+                    headers=headers,
+                )
+            except requests.ConnectionError as e:
+                if not self.retry_policy.should_retry(method, None, attempt):
+                    raise
+                delay = self.retry_policy.delay_of(attempt)
+                logger.info("Retrying %s %s in %.1fs after %s", method, url, delay, e)
+            else:
+                if not self.retry_policy.should_retry(method, resp.status_code, attempt):
+                    break
+                delay = self.retry_policy.delay_of(attempt, resp)
+                logger.info("Retrying %s %s in %.1fs after status %s", method, url, delay, resp.status_code)
+            time.sleep(delay)
+            attempt += 1
         try:
             resp.raise_for_status()
         except:
             logger.debug(resp.text)
             raise
+        return resp
+
+    @staticmethod
+    def _parse(resp):
         if resp.text:
             return resp.json()
         return None
 
+    def _get(self, url, params=None, cache_kind=None):
+        if self.cache is None or cache_kind is None:
+            return self._request("get", url, params=params)
+        return self._cached_get(url, params, self.cache.ttls[cache_kind])
+
+    def _cached_get(self, url, params, ttl):
+        key = self.cache.key_of(self.cache_namespace, url, params)
+        cached = self.cache.get(key)
+        if cached is not None and cached.fresh:
+            return cached.body
+        headers = None
+        if cached is not None and cached.etag:
+            headers = {"If-None-Match": cached.etag}
+        resp = self._send("get", url, params=params, headers=headers)
+        if resp.status_code == 304:
+            self.cache.touch(key, ttl)
+            return cached.body
+        body = self._parse(resp)
+        self.cache.put(key, self.cache_namespace, body, resp.headers.get("ETag"), ttl)
+        return body
+
+    def invalidate_cache(self):
+        if self.cache is not None:
+            self.cache.invalidate(self.cache_namespace)
+
+
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
 
 def _in_range(dt, min_dt, max_dt):
     if min_dt is not None and dt < min_dt:
@@ -48,49 +163,80 @@ def _in_range(dt, min_dt, max_dt):
 
 
 class TogglApi(BaseApi):
-    def __init__(self, secrets=None, api_base=None):
+    def __init__(self, secrets=None, api_base=None, cache=None, metadata_ttl=None, pool_size=None,
+                 rate_limiter=None, retry_policy=None):
         if api_base is None:
             api_base = "https://www.toggl.com/api/"
+        if metadata_ttl is None:
+            metadata_ttl = 60 * 60
         if secrets is None:
             secrets = settingsloader.get_secrets()
-        session = requests.Session()
-        session.auth = HTTPBasicAuth(secrets.toggl_apitoken, "api_token")
-        super().__init__(session, api_base)
-
-    def _get(self, url, params=None):
-        return self._request("get", url, params=params)
+        session = create_session(auth=HTTPBasicAuth(secrets.toggl_apitoken, "api_token"), pool_size=pool_size)
+        cache_namespace = "toggl {} {}".format(api_base, hashlib.sha256(secrets.toggl_apitoken.encode()).hexdigest())
+        super().__init__(
+            session,
+            api_base,
+            cache=cache,
+            cache_namespace=cache_namespace,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+        )
+        self.metadata_ttl = metadata_ttl
 
     def get_projects(self, workspace_id):
-        return self._get("v8/workspaces/{workspace_id}/projects".format(workspace_id=workspace_id))
+        return self._get(
+            "v8/workspaces/{workspace_id}/projects".format(workspace_id=workspace_id),
+            cache_kind="metadata",
+        )
 
     def get_workspaces(self):
-        return self._get("v8/workspaces")
+        return self._get("v8/workspaces", cache_kind="metadata")
 
     def get_entries(self, start_datetime=None, end_datetime=None):
+        params = self._entries_params(start_datetime, end_datetime)
+        return self._get("v8/time_entries", params=params, cache_kind="data")
+
+    @staticmethod
+    def _entries_params(start_datetime, end_datetime):
         params = {}
         if start_datetime is not None:
             params["start_date"] = datetime_toggl_format.to_str(start_datetime)
         if end_datetime is not None:
             params["end_date"] = datetime_toggl_format.to_str(end_datetime)
-        return self._get("v8/time_entries", params=params)
+        return params
+
+    def get_metadata(self, workspace_name):
+        workspace = toggl_metadata_cache.get(
+            ("workspace", self.cache_namespace, workspace_name),
+            lambda: dicts.find_first(self.get_workspaces(), name=workspace_name),
+            self.metadata_ttl,
+        )
+        # projects are shared by everyone in the workspace, so they are not keyed by the user
+        return toggl_metadata_cache.get(
+            ("projects", self.api_base, workspace["id"]),
+            lambda: create_toggl_metadata(workspace, self.get_projects(workspace["id"])),
+            self.metadata_ttl,
+        )
 
     def get_worklog(self, workspace_name, min_datetime=None, max_datetime=None):
-        workspaces = self.get_workspaces()
-        workspace = dicts.find_first(workspaces, name=workspace_name)
-        projects = self.get_projects(workspace["id"])
-        project_by_id = utils.index_by_id(projects)
+        metadata = self.get_metadata(workspace_name)
         entries = self.get_entries(start_datetime=min_datetime, end_datetime=max_datetime)
+        return self._worklog_result(metadata, entries, min_datetime, max_datetime)
+
+    @classmethod
+    def _worklog_result(cls, metadata, entries, min_datetime, max_datetime):
+        project_by_id = metadata.projects_by_id
         # TODO: check if this can return worklogs of other people, consider filtering for uid
         assert len(set(e["uid"] for e in entries)) <= 1
         worklog = [
-            self._extract_entry(entry, project_by_id.get(entry.get("pid")), entry.get("pid"))
+            cls._extract_entry(entry, project_by_id.get(entry.get("pid")), entry.get("pid"))
             for entry in entries
         ]
         worklog = [w for w in worklog if _in_range(w.start, min_datetime, max_datetime)]
         return {
-            "workspace": workspace,
-            "projects": projects,
-            "entries": entries,
+            "workspace": metadata.workspace,
+            "projects": metadata.projects,
+            "metadata": metadata,
             "worklog": worklog,
         }
 
@@ -115,7 +261,6 @@ class TogglApi(BaseApi):
                 project_pid=project_pid,
                 billable=entry.get("billable"),
                 jira_project=jira_project,
-                raw_entry=entry
             ),
         )
 
@@ -123,10 +268,24 @@ class TogglApi(BaseApi):
     def _extract_issue(description):
         return utils.strip_after_any(description.strip(), (":", " ")).strip()
 
+    def get_entry(self, id):
+        return self._get_entry(id)["data"]
+
     def _get_entry(self, id):
         return self._get("v8/time_entries/{id}".format(id=id))
 
     def _put_entry(self, id, data):
+        return self._request("put", "v8/time_entries/{id}".format(id=id), json={"time_entry": self._entry_data(data)})
+
+    def bulk_update(self, ids, data):
+        return self._request(
+            "put",
+            "v8/time_entries/{ids}".format(ids=",".join(str(id) for id in ids)),
+            json={"time_entry": self._entry_data(data)},
+        )
+
+    @staticmethod
+    def _entry_data(data):
         data = [
             ("description", data.get("comment")),
             ("start", data.get("start")),
@@ -134,11 +293,24 @@ class TogglApi(BaseApi):
             ("pid", data.get("pid")),
             ("billable", data.get("billable")),
         ]
-        data = {k: v for k, v in data if v is not None}
-        return self._request("put", "v8/time_entries/{id}".format(id=id), json={"time_entry": data})
+        return {k: v for k, v in data if v is not None}
+
+
+class WorklogFetchError(Exception):
+    def __init__(self, errors):
+        super().__init__("Failed to fetch worklog of issues {}".format(", ".join(errors)))
+        self.errors = errors
 
 
 JiraWorklogFilter = namedtuple("JiraWorklogFilter", ["author", "min_date", "max_date"])
+IssueWorklog = namedtuple("IssueWorklog", ["issue_key", "embedded", "worklog", "error"])
+
+
+def _issue_worklog_of(issue_key, embedded, future):
+    try:
+        return IssueWorklog(issue_key=issue_key, embedded=embedded, worklog=future.result(), error=None)
+    except Exception as e:
+        return IssueWorklog(issue_key=issue_key, embedded=embedded, worklog=None, error=e)
 
 
 def _extract_jira_project_from_issue(issue):
@@ -146,32 +318,102 @@ def _extract_jira_project_from_issue(issue):
 
 
 class JiraApi(BaseApi):
-    def __init__(self, api_base, auth=None):
-        session = requests.Session()
-        session.auth = auth
-        super().__init__(session=session, api_base=api_base)
+    def __init__(self, api_base, auth=None, max_concurrency=None, cache=None, rate_limiter=None, retry_policy=None):
+        if max_concurrency is None:
+            max_concurrency = 8
+        session = create_session(auth=auth, pool_size=max_concurrency)
+        cache_namespace = "jira {} {}".format(api_base, getattr(auth, "username", None))
+        super().__init__(
+            session=session,
+            api_base=api_base,
+            cache=cache,
+            cache_namespace=cache_namespace,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+        )
+        self.max_concurrency = max_concurrency
 
     def get_worklog(self, author=None, min_datetime=None, max_datetime=None):
         worklog_filter = JiraWorklogFilter(author=author, min_date=min_datetime, max_date=max_datetime)
         jql = self._assemble_jql(worklog_filter, date_error_margin=datetime.timedelta(days=1))
-        worklog_resp = self.execute_jql(jql)
-        worklog = self._get_filtered_worklogs(worklog_resp, worklog_filter)
+        issues = self.execute_jql(jql, fields=["key", "worklog"])
+        issue_keys, worklog, requests_saved = self._get_filtered_worklogs(issues, worklog_filter)
+        logger.info("Embedded worklogs saved %d of %d worklog requests", requests_saved, len(issue_keys))
         return {
             "jql": jql,
             "worklog_filter": worklog_filter,
-            "worklog_resp": worklog_resp,
+            "issues": issue_keys,
             "worklog": worklog,
+            "worklog_requests_saved": requests_saved,
         }
 
-    def execute_jql(self, jql):
-        return self._get("rest/api/2/search", params={"jql": jql})
+    def execute_jql(self, jql, fields=None, page_size=None):
+        if fields is None:
+            fields = ["key"]
+        if page_size is None:
+            page_size = 100
+        start_at = 0
+        while True:
+            params = self._search_params(jql, fields, start_at, page_size)
+            # the pages are not cached, pages cached at different times could skip or repeat issues
+            resp = self._get("rest/api/2/search", params=params)
+            issues = resp["issues"]
+            yield from issues
+            start_at += len(issues)
+            if not issues or start_at >= resp["total"]:
+                return
 
-    def _get_filtered_worklogs(self, resp, worklog_filter):
-        return [
-            worklog_item
-            for issue in resp["issues"]
-            for worklog_item in self._fetch_worklog(worklog_filter, issue)
-        ]
+    @staticmethod
+    def _search_params(jql, fields, start_at, page_size):
+        return {
+            "jql": jql,
+            "startAt": start_at,
+            "maxResults": page_size,
+            "fields": ",".join(fields),
+        }
+
+    def _get_filtered_worklogs(self, issues, worklog_filter):
+        issue_keys = []
+        worklog = []
+        requests_saved = 0
+        errors = OrderedDict()
+        for issue_worklog in self._iter_issue_worklogs(issues, worklog_filter):
+            issue_keys.append(issue_worklog.issue_key)
+            if issue_worklog.error is not None:
+                logger.warning("Failed to fetch worklog of issue %s: %s", issue_worklog.issue_key, issue_worklog.error)
+                errors[issue_worklog.issue_key] = issue_worklog.error
+                continue
+            if issue_worklog.embedded:
+                requests_saved += 1
+            worklog.extend(issue_worklog.worklog)
+        if errors:
+            raise WorklogFetchError(errors)
+        return issue_keys, worklog, requests_saved
+
+    def _iter_issue_worklogs(self, issues, worklog_filter, max_in_flight=None):
+        # issues may be a generator over search pages, it is only read further once the oldest of the at most
+        # max_in_flight issues being fetched is done, so neither the pages nor the futures pile up
+        if max_in_flight is None:
+            max_in_flight = 2 * self.max_concurrency
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for issue in issues:
+                embedded_worklogs = self._get_complete_embedded_worklogs(issue)
+                if embedded_worklogs is None:
+                    future = executor.submit(self._fetch_worklog_list, worklog_filter, issue)
+                else:
+                    future = _completed_future(list(self._extract_worklogs(worklog_filter, issue, embedded_worklogs)))
+                in_flight.append((issue["key"], embedded_worklogs is not None, future))
+                while len(in_flight) >= max_in_flight:
+                    yield _issue_worklog_of(*in_flight.popleft())
+            while in_flight:
+                yield _issue_worklog_of(*in_flight.popleft())
+
+    def get_entry(self, issue, worklog_id):
+        return self._get("rest/api/2/issue/{issue}/worklog/{worklog_id}".format(
+            issue=issue,
+            worklog_id=worklog_id,
+        ))
 
     def delete_entry(self, issue, worklog_id):
         self._request(
@@ -198,8 +440,29 @@ class JiraApi(BaseApi):
             json=data
         )
 
-    def _get(self, url, params=None):
-        return self._request("get", url, params=params)
+    def get_updated_worklog_ids(self, since):
+        return self._get_worklog_feed("updated", since)
+
+    def get_deleted_worklog_ids(self, since):
+        return self._get_worklog_feed("deleted", since)
+
+    def _get_worklog_feed(self, feed, since):
+        ids = []
+        while True:
+            resp = self._get("rest/api/2/worklog/{feed}".format(feed=feed), params={"since": since})
+            ids.extend(value["worklogId"] for value in resp["values"])
+            since = max(since, resp["until"])
+            if resp["lastPage"]:
+                return ids, since
+
+    def get_worklogs_by_ids(self, ids, chunk_size=1000):
+        worklogs = []
+        for i in range(0, len(ids), chunk_size):
+            worklogs.extend(self._request("post", "rest/api/2/worklog/list", json={"ids": ids[i:i + chunk_size]}))
+        return worklogs
+
+    def get_issue_key(self, issue_id):
+        return self._get("rest/api/2/issue/{id}".format(id=issue_id), params={"fields": "key"})["key"]
 
     @staticmethod
     def _assemble_jql(worklog_filter, date_error_margin=None):
@@ -220,11 +483,25 @@ class JiraApi(BaseApi):
             ))
         return " AND ".join(filters)
 
+    def _fetch_worklog_list(self, worklog_filter, issue):
+        return list(self._fetch_worklog(worklog_filter, issue))
+
     def _fetch_worklog(self, worklog_filter, issue):
-        resp = self._get("rest/api/2/issue/{key}/worklog".format(key=issue["key"]))
-        for worklog in resp["worklogs"]:
-            if self._worklog_matches_filter(worklog, worklog_filter):
-                started = datetime_jira_format.from_str(worklog["started"])
+        resp = self._get("rest/api/2/issue/{key}/worklog".format(key=issue["key"]), cache_kind="data")
+        return self._extract_worklogs(worklog_filter, issue, resp["worklogs"])
+
+    @staticmethod
+    def _get_complete_embedded_worklogs(issue):
+        embedded = issue.get("fields", {}).get("worklog")
+        if embedded is None or embedded["total"] > embedded["maxResults"]:
+            return None
+        return embedded["worklogs"]
+
+    @classmethod
+    def _extract_worklogs(cls, worklog_filter, issue, worklogs):
+        for worklog in worklogs:
+            started = datetime_jira_format.from_str(worklog["started"])
+            if cls._worklog_matches_filter(worklog, worklog_filter, started):
                 ended = started + datetime.timedelta(seconds=worklog["timeSpentSeconds"])
                 yield WorklogEntry(
                     issue=issue["key"],
@@ -238,7 +515,7 @@ class JiraApi(BaseApi):
                 )
 
     @staticmethod
-    def _worklog_matches_filter(worklog_entry_dto, worklog_filter):
+    def _worklog_matches_filter(worklog_entry_dto, worklog_filter, started):
         if worklog_filter.author not in [
             worklog_entry_dto["author"].get("key"),
             worklog_entry_dto["author"].get("name"),
@@ -246,5 +523,4 @@ class JiraApi(BaseApi):
             worklog_entry_dto["author"].get("displayName"),
         ]:
             return False
-        started = datetime_jira_format.from_str(worklog_entry_dto["started"])
         return _in_range(started, worklog_filter.min_date, worklog_filter.max_date)
@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import json
 import pprint
 import time
@@ -10,12 +11,13 @@ from markupsafe import Markup
 from tzlocal import get_localzone
 from werkzeug.urls import url_encode
 
-from . import settingsloader, utils, actions, service, api_controller
-from .api_service import determine_actions_and_map
-from .core import DayBin, calculate_pairing
+from . import settingsloader, utils, service, api_controller, scheduler, shared_state
+from .api_service import get_window_dates, inspect_interval
+from .core import DayBin
+from .day_models import FragmentCache, date_runs, get_model_cache
+from .job_log import SETTLED, get_job_log
 from .formats import datetime_toggl_format, datetime_my_date_format
-from .service import aware_now
-from .session import SingletonMemorySessionInterface
+from .session import SingletonMemorySessionInterface, SharedStateSessionInterface
 import mimetypes
 
 app = flask.Flask(__name__)
@@ -37,6 +39,11 @@ def request_timestamp():
     app.logger.info("Serving request %s", flask.request.path)
 
 
+@app.before_request
+def start_scheduler():
+    scheduler.ensure_started()
+
+
 @app.template_filter("pretty_json")
 def pretty_json(value):
     return json.dumps(value, sort_keys=True, indent=4, separators=(',', ': '))
@@ -123,11 +130,44 @@ def _not_defined(x):
 IndexArgs = namedtuple("IndexArgs", ["delta"])
 
 
+day_fragment_cache = FragmentCache()
+
+
 @app.route('/')
 def index():
     args = _get_index_args()
     model = _ensure_model(args.delta)
-    return flask.render_template("index.html", model=model, **model)
+    apis = service.get_apis()
+    unfinished_jobs = get_job_log(apis.settings).unfinished_jobs(apis.secrets.jira_username)
+    etag = _model_etag(model, unfinished_jobs)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        day_fragments = [
+            day_fragment_cache.get(day["hash"], lambda: Markup(flask.render_template("day.html", daydef=day)))
+            for day in model["days"]
+        ]
+        response = flask.make_response(flask.render_template(
+            "index.html",
+            model=model,
+            day_fragments=day_fragments,
+            unfinished_jobs=unfinished_jobs,
+            computed_at_datetime=datetime.datetime.fromtimestamp(model["computed_at"], datetime.timezone.utc),
+            **model
+        ))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _model_etag(model, unfinished_jobs):
+    content = [
+        model["delta"],
+        model["computed_at"],
+        [day["hash"] for day in model["days"]],
+        [job.id for job in unfinished_jobs],
+    ]
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
 
 
 @app.route('/', methods=["POST"])
@@ -135,21 +175,33 @@ def index_post():
     args = _get_index_args()
     action = flask.request.form.get("action")
     if action == "refresh":
-        _ensure_model(args.delta, force_refresh=True)
+        service.invalidate_caches(service.get_apis())
+        refresh_day = flask.request.form.get("day")
+        if refresh_day:
+            _ensure_model(args.delta, refresh_day=datetime_my_date_format.from_str(refresh_day).date())
+        else:
+            scheduler.invalidate()
+            _ensure_model(args.delta, force_refresh=True)
         return reload_using_get()
     if action == "sync":
         action_day = flask.request.form.get("day")
         days = _ensure_model(args.delta)["days"]
         day = utils.first(days, lambda d: d["key"] == action_day)
-        flask.session["running_action"] = SyncState(day["actions"])
-        return flask.redirect(flask.url_for("execute_actions"))
+        apis = service.get_apis()
+        job_id = get_job_log(apis.settings).create_job(
+            apis.secrets.jira_username,
+            day["key"],
+            day["actions"],
+            planned_at=day["computed_at"],
+        )
+        flask.session["running_action"] = SyncState(job_id)
+        return flask.redirect(flask.url_for("execute_actions", job=job_id))
     raise KeyError("Unknown action {action}".format(action=action))
 
 
 class SyncState(object):
-    def __init__(self, actions, index=0):
-        self.actions = actions
-        self.index = index
+    def __init__(self, job_id):
+        self.job_id = job_id
 
 
 def reload_using_get():
@@ -161,80 +213,113 @@ def _get_index_args():
     return IndexArgs(delta=delta)
 
 
-def _ensure_model(delta, force_refresh=False):
-    session = flask.session
-    model = session.get("model")
-    if force_refresh or model is None or model["delta"] != delta:
-        model = _fetch_model(delta)
-        session["model"] = model
-    return model
-
-
-def _fetch_model(delta):
-    day_bin = DayBin()
+def _ensure_model(delta, force_refresh=False, refresh_day=None):
     settings = settingsloader.get_settings()
     apis = service.get_apis(settings=settings)
-    today = day_bin.date_of(aware_now())
-
     if apis.secrets is None:
         return flask.render_template("setup.html")
 
-    min_datetime = day_bin.start_datetime_of(today) + datetime.timedelta(days=delta - 7)
-    max_datetime = day_bin.end_datetime_of(today) + datetime.timedelta(days=delta)
-
-    jira_worklog = apis.jira.get_worklog(
-        author=apis.secrets.jira_username,
-        min_datetime=min_datetime,
-        max_datetime=max_datetime,
-    )
-    toggl_worklog = apis.toggl.get_worklog(
-        workspace_name=settings.toggl_workspace_name,
-        min_datetime=min_datetime,
-        max_datetime=max_datetime,
-    )
-    pairings = calculate_pairing(toggl_worklog["worklog"], jira_worklog["worklog"])
-    diff_gatherer = actions.DiffGather(settings=settings, projects=toggl_worklog["projects"])
-    rows = [
-        determine_actions_and_map(pairing, diff_gatherer)
-        for pairing in pairings
-    ]
-    days = utils.into_bins(rows, lambda e: day_bin.date_of(e["start"]), sorting='desc')
-    days = [aggregate_actions(day) for day in days]
-
-    return dict(
-        days=days,
-        delta=delta,
-        projects=toggl_worklog["projects"],
-        entries=toggl_worklog["entries"],
-    )
-
-
-def invalidate_cached_model():
-    flask.session["model"] = None
+    day_bin = DayBin()
+    dates = get_window_dates(delta, day_bin=day_bin)
+    model_cache = get_model_cache(settings)
+    user = apis.secrets.jira_username
+    if force_refresh:
+        model_cache.invalidate(user=user)
+    if refresh_day is not None:
+        model_cache.invalidate(user=user, day=refresh_day)
+    store = model_cache.get(user, dates)
+    changed = False
+
+    snapshot = scheduler.get_snapshot() if not force_refresh else None
+    if snapshot is not None and snapshot.computed_at != store.snapshot_computed_at:
+        # every day of the snapshot is cached, not only those of this window, as the cache is shared by all windows
+        store.put_result(snapshot.result, _snapshot_dates(snapshot, day_bin), snapshot.computed_at, day_bin)
+        store.snapshot_computed_at = snapshot.computed_at
+        changed = True
+
+    missing = store.missing(dates, ttl=settings.days_ttl)
+    for run in date_runs(missing):
+        # the days are as old as the start of the fetch, so a sync done meanwhile is not taken as included
+        fetched_at = time.time()
+        result = inspect_interval(day_bin.start_datetime_of(run[0]), day_bin.end_datetime_of(run[-1]), apis=apis)
+        store.put_result(result, run, fetched_at, day_bin)
+        changed = True
+    if changed:
+        model_cache.save(user, store)
+    return store.build_model(dates, delta)
+
+
+def _snapshot_dates(snapshot, day_bin):
+    # the days the snapshot covers completely, its window may be older than the current one
+    dates = []
+    date = day_bin.date_of(snapshot.min_datetime)
+    while day_bin.end_datetime_of(date) <= snapshot.max_datetime:
+        if day_bin.start_datetime_of(date) >= snapshot.min_datetime:
+            dates.append(date)
+        date += datetime.timedelta(days=1)
+    return dates
+
+
+def invalidate_cached_model(day=None):
+    apis = service.get_apis()
+    if apis.secrets is not None:
+        get_model_cache(apis.settings).invalidate(user=apis.secrets.jira_username, day=day)
+    scheduler.invalidate()
 
 
 @app.route('/execute-actions', methods=["GET", "POST"])
 def execute_actions():
-    action_state = flask.session["running_action"]
-    action_list = action_state.actions
-    action_index = action_state.index
-
-    finished = True
-    if action_index < len(action_list):
-        finished = False
-        if flask.request.method == "POST":
-            action = action_list[action_index]
-            service.ActionExecutor().execute(action)
-            action_state.index += 1
-    else:
-        invalidate_cached_model()
-    display_action_index = min(action_index + 1, len(action_list))
+    job_log = get_job_log(settingsloader.get_settings())
+    job_id = flask.request.args.get("job")
+    if job_id is None:
+        job_id = flask.session["running_action"].job_id
+    job = job_log.get_job(job_id)
+    if job is None:
+        flask.abort(404)
+    if flask.request.method == "GET" and job.finished is None:
+        # a job opened again, e.g. after a restart, continues from its log
+        job_log.resume(job_id)
+        job = job_log.get_job(job_id)
+
+    action_index = _next_action_index(job)
+    finished = action_index == len(job.actions)
+    waiting = False
+    if not finished and flask.request.method == "POST":
+        job_action = job.actions[action_index]
+        if job_log.start(job_id, job_action.seq):
+            try:
+                service.ActionExecutor().execute(job_action.action)
+            except Exception as e:
+                job_log.failed(job_id, job_action.seq, e)
+                raise
+            job_log.done(job_id, job_action.seq)
+        else:
+            # another tab or worker is running this action, the page polls until it is done. When that runner died,
+            # the action is released once it is stale, so polling does not wait forever
+            job_log.resume(job_id)
+            waiting = True
+        job = job_log.get_job(job_id)
+        action_index = _next_action_index(job)
+    if finished and job.finished is None:
+        job_log.finish(job_id)
+        invalidate_cached_model(datetime_my_date_format.from_str(job.day).date())
+    display_action_index = min(action_index + 1, len(job.actions))
     return flask.render_template(
         "execute-actions.html",
         finished=finished,
-        action_list=action_list,
+        job=job,
+        action_list=[job_action.action for job_action in job.actions],
         action_index=action_index,
         display_action_index=display_action_index,
+        waiting=waiting,
+    )
+
+
+def _next_action_index(job):
+    return utils.first(
+        range(len(job.actions)),
+        lambda i: job.actions[i].status not in SETTLED,
+        default=len(job.actions),
     )
 
 
@@ -256,25 +341,19 @@ def shutdown_server():
     func()
 
 
-def aggregate_actions(day):
-    actions = [
-        action
-        for pairing in day[1]
-        for action in pairing["actions"]
-    ]
-    return {
-        "key": datetime_my_date_format.to_str(day[0]),
-        "day": day[0],
-        "pairings": day[1],
-        "actions": actions,
-        "sync_form": {
-            "actions": json.dumps(actions)
-        }
-    }
+def configure(settings=None):
+    # fails on broken configuration at startup rather than on the first request
+    if settings is None:
+        settings = settingsloader.get_settings()
+    state = shared_state.get_shared_state(settings)
+    if state is not None:
+        app.session_interface = SharedStateSessionInterface(state)
+    return state
 
 
 def main():
     args = settingsloader.parse_args()
+    configure()
     app.run(debug=args.debug)
 
 
@@ -0,0 +1,77 @@
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import api_service, service, settingsloader
+
+logger = logging.getLogger(__name__)
+
+
+def sync_user(secrets, settings, min_datetime, max_datetime, dry_run=False):
+    started = time.monotonic()
+    summary = {
+        "user": secrets.jira_username,
+        "rows": 0,
+        "actions": 0,
+        "executed": 0,
+        "failed": [],
+        "timings": None,
+        "error": None,
+    }
+    try:
+        apis = service.get_apis(secrets=secrets, settings=settings)
+        result = api_service.inspect_interval(min_datetime, max_datetime, apis=apis)
+        action_groups = [row["actions"] for row in result["rows"]]
+        summary["rows"] = len(result["rows"])
+        summary["actions"] = sum(len(action_group) for action_group in action_groups)
+        summary["timings"] = result["timings"]
+        if not dry_run:
+            for progress in service.ActionExecutor(apis=apis).execute_groups(action_groups):
+                if progress.error is None:
+                    summary["executed"] += 1
+                else:
+                    summary["failed"].append({"action": progress.action, "error": str(progress.error)})
+    except Exception as e:
+        logger.exception("Sync of user %s failed", secrets.jira_username)
+        summary["error"] = str(e)
+    summary["seconds"] = time.monotonic() - started
+    return summary
+
+
+def run_batch(users, settings, min_datetime, max_datetime, workers=None, dry_run=False):
+    # Toggl project metadata and the HTTP rate limiters are process-wide, so the users share them
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda secrets: sync_user(secrets, settings, min_datetime, max_datetime, dry_run=dry_run),
+            users,
+        ))
+
+
+def main():
+    args = settingsloader.parse_batch_args()
+    settings = settingsloader.get_settings()
+    users = settingsloader.get_user_secrets(args.users)
+    while True:
+        min_datetime, max_datetime = api_service.get_window(args.delta)
+        logger.info("Syncing %d users from %s to %s", len(users), min_datetime, max_datetime)
+        report = {
+            "min": min_datetime.isoformat(),
+            "max": max_datetime.isoformat(),
+            "dry_run": args.dry_run,
+            "users": run_batch(users, settings, min_datetime, max_datetime, workers=args.workers, dry_run=args.dry_run),
+        }
+        _write_report(report, args.report)
+        if args.interval is None:
+            return
+        time.sleep(args.interval)
+
+
+def _write_report(report, filename):
+    if filename is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
@@ -1,19 +1,112 @@
+import bisect
 import datetime
-from collections import namedtuple, OrderedDict
+import sys
+from collections import OrderedDict
 
 from tzlocal import get_localzone
 
-WorklogEntry = namedtuple("WorklogEntry", [
-    "issue",
-    "start",
-    "stop",
-    "comment",
-    "tag",
-])
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
-def calculate_pairing(toggl_logs, jira_logs):
-    pairings = _calculate_pairing(toggl_logs, jira_logs, _worklog_entry_distance, 5)
+class WorklogEntry(object):
+    # start and stop are kept as epoch milliseconds and their tzinfo, datetimes are only built when asked for
+    __slots__ = ("issue", "start_ms", "start_tz", "stop_ms", "stop_tz", "comment", "tag")
+
+    def __init__(self, issue, start, stop, comment, tag):
+        self.issue = issue
+        self.start_ms = to_epoch_ms(start)
+        self.start_tz = _shared_tzinfo(start)
+        self.stop_ms = to_epoch_ms(stop)
+        self.stop_tz = _shared_tzinfo(stop)
+        self.comment = sys.intern(comment) if isinstance(comment, str) else comment
+        self.tag = tag
+
+    @property
+    def start(self):
+        return from_epoch_ms(self.start_ms, self.start_tz)
+
+    @property
+    def stop(self):
+        return from_epoch_ms(self.stop_ms, self.stop_tz)
+
+    def _key(self):
+        return self.issue, self.start_ms, self.stop_ms, self.comment, self.tag
+
+    def __eq__(self, other):
+        if not isinstance(other, WorklogEntry):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return "WorklogEntry(issue={!r}, start={!r}, stop={!r}, comment={!r}, tag={!r})".format(
+            self.issue, self.start, self.stop, self.comment, self.tag)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+_timezones = dict()
+
+
+def to_epoch_ms(dt):
+    if dt is None:
+        return None
+    return (dt - _EPOCH) // _MILLISECOND
+
+
+def from_epoch_ms(ms, tz=None):
+    if ms is None:
+        return None
+    dt = _EPOCH + datetime.timedelta(milliseconds=ms)
+    if tz is None:
+        return dt
+    return dt.astimezone(tz)
+
+
+def _shared_tzinfo(dt):
+    # the parsers create a timezone object for every timestamp, the entries share one for each offset instead
+    if dt is None:
+        return None
+    tz = dt.tzinfo
+    if type(tz) is not datetime.timezone:
+        return tz
+    return _timezones.setdefault((tz.utcoffset(None), tz.tzname(None)), tz)
+
+
+PAIRING_THRESHOLD = 5
+_START_WEIGHT = 2
+_DATETIME_DIST_UNIT = 60 * 60 * 1000
+
+
+PAIRING_ENGINES = ("auto", "python", "numpy")
+# below this many candidate pairs, setting up the arrays costs more than the python loop
+_NUMPY_MIN_PAIRS = 10000
+_NUMPY_BLOCK_SIZE = 256
+
+
+def calculate_pairing(toggl_logs, jira_logs, engine=None):
+    if engine is None:
+        engine = "auto"
+    if engine not in PAIRING_ENGINES:
+        raise ValueError("Unknown pairing engine {!r}".format(engine))
+    if engine == "numpy" and numpy is None:
+        raise RuntimeError("The numpy pairing engine needs numpy installed")
+    if engine == "numpy" or engine == "auto" and numpy is not None and (
+            len(toggl_logs) * len(jira_logs) >= _NUMPY_MIN_PAIRS):
+        pairings = _calculate_worklog_pairing_numpy(toggl_logs, jira_logs, PAIRING_THRESHOLD)
+    else:
+        pairings = _calculate_pairing(
+            toggl_logs,
+            jira_logs,
+            _worklog_entry_distance,
+            PAIRING_THRESHOLD,
+            max_start_delta=_max_start_delta(PAIRING_THRESHOLD),
+        )
     return sorted(
         [
             {
@@ -29,13 +122,12 @@ def calculate_pairing(toggl_logs, jira_logs):
     )
 
 
-def _calculate_pairing(xs, ys, distfn, threshold):
+def _calculate_pairing(xs, ys, distfn, threshold, max_start_delta=None):
     xs = OrderedDict(enumerate(xs))
     ys = OrderedDict(enumerate(ys))
     dists = sorted(
-        (distfn(xvalue, yvalue), xid, yid)
-        for xid, xvalue in xs.items()
-        for yid, yvalue in ys.items()
+        (distfn(xs[xid], ys[yid]), xid, yid)
+        for xid, yid in _candidate_pairs(xs, ys, max_start_delta)
     )
     for dist, xid, yid in dists:
         if dist > threshold:
@@ -48,6 +140,115 @@ def _calculate_pairing(xs, ys, distfn, threshold):
         yield (None, y, None)
 
 
+def _candidate_pairs(xs, ys, max_start_delta):
+    if max_start_delta is None:
+        for xid in xs:
+            for yid in ys:
+                yield xid, yid
+        return
+    ys_by_start = sorted((y.start_ms, yid) for yid, y in ys.items() if y.start_ms is not None)
+    starts = [start for start, _ in ys_by_start]
+    for xid, x in xs.items():
+        if x.start_ms is None:
+            continue
+        lo = bisect.bisect_left(starts, x.start_ms - max_start_delta)
+        hi = bisect.bisect_right(starts, x.start_ms + max_start_delta)
+        for _, yid in ys_by_start[lo:hi]:
+            yield xid, yid
+
+
+def _calculate_worklog_pairing_numpy(xs, ys, threshold):
+    # same greedy assignment as _calculate_pairing with _worklog_entry_distance, the distances are computed
+    # with the same float operations in the same order, so the pairs and their distances match exactly
+    xs = list(xs)
+    ys = list(ys)
+    ids = dict()
+    x_arrays = _worklog_arrays(xs, ids)
+    y_arrays = _worklog_arrays(ys, ids)
+    max_start_delta = _max_start_delta(threshold)
+
+    y_order = numpy.argsort(y_arrays["start"], kind="stable")
+    y_order = y_order[y_arrays["has_start"][y_order]]
+    y_starts = y_arrays["start"][y_order]
+    x_order = numpy.argsort(x_arrays["start"], kind="stable")
+    x_order = x_order[x_arrays["has_start"][x_order]]
+
+    found_dists = []
+    found_xids = []
+    found_yids = []
+    for block_start in range(0, len(x_order), _NUMPY_BLOCK_SIZE):
+        xids = x_order[block_start:block_start + _NUMPY_BLOCK_SIZE]
+        x_starts = x_arrays["start"][xids]
+        lo = numpy.searchsorted(y_starts, x_starts[0] - max_start_delta, side="left")
+        hi = numpy.searchsorted(y_starts, x_starts[-1] + max_start_delta, side="right")
+        if lo >= hi:
+            continue
+        yids = y_order[lo:hi]
+        dists = _worklog_distance_matrix(x_arrays, xids, y_arrays, yids)
+        rows, cols = numpy.nonzero(dists <= threshold)
+        found_dists.append(dists[rows, cols])
+        found_xids.append(xids[rows])
+        found_yids.append(yids[cols])
+
+    x_free = [True] * len(xs)
+    y_free = [True] * len(ys)
+    if found_dists:
+        dists = numpy.concatenate(found_dists)
+        xids = numpy.concatenate(found_xids)
+        yids = numpy.concatenate(found_yids)
+        order = numpy.lexsort((yids, xids, dists))
+        for dist, xid, yid in zip(dists[order].tolist(), xids[order].tolist(), yids[order].tolist()):
+            if x_free[xid] and y_free[yid]:
+                x_free[xid] = False
+                y_free[yid] = False
+                yield (xs[xid], ys[yid], dist)
+    for xid, free in enumerate(x_free):
+        if free:
+            yield (xs[xid], None, None)
+    for yid, free in enumerate(y_free):
+        if free:
+            yield (None, ys[yid], None)
+
+
+def _worklog_arrays(worklog, ids):
+    def _id_of(value):
+        return ids.setdefault(value, len(ids))
+    return {
+        "issue": numpy.array([_id_of(w.issue) for w in worklog], dtype=numpy.int64),
+        "comment": numpy.array([_id_of(w.comment) for w in worklog], dtype=numpy.int64),
+        "start": numpy.array([w.start_ms if w.start_ms is not None else 0 for w in worklog], dtype=numpy.int64),
+        "has_start": numpy.array([w.start_ms is not None for w in worklog], dtype=bool),
+        "stop": numpy.array([w.stop_ms if w.stop_ms is not None else 0 for w in worklog], dtype=numpy.int64),
+        "has_stop": numpy.array([w.stop_ms is not None for w in worklog], dtype=bool),
+    }
+
+
+def _worklog_distance_matrix(x_arrays, xids, y_arrays, yids):
+    def _column(arrays, key, ids):
+        return arrays[key][ids][:, numpy.newaxis]
+
+    def _row(arrays, key, ids):
+        return arrays[key][ids][numpy.newaxis, :]
+
+    def _datetime_dist(key):
+        dist = numpy.abs(_column(x_arrays, key, xids) - _row(y_arrays, key, yids)) / _DATETIME_DIST_UNIT
+        has_both = _column(x_arrays, "has_" + key, xids) & _row(y_arrays, "has_" + key, yids)
+        return numpy.where(has_both, dist, 100)
+
+    issue_dist = (_column(x_arrays, "issue", xids) != _row(y_arrays, "issue", yids)).astype(numpy.int64)
+    comment_dist = (_column(x_arrays, "comment", xids) != _row(y_arrays, "comment", yids)).astype(numpy.int64)
+    return (
+        (2 * issue_dist + 1 * comment_dist).astype(numpy.float64)
+        + _START_WEIGHT * _datetime_dist("start")
+        + 1 * _datetime_dist("stop")
+    )
+
+
+def _max_start_delta(threshold):
+    # Every term of the distance is non-negative, so a pair stays under the threshold only if its start term does.
+    return _DATETIME_DIST_UNIT * threshold / _START_WEIGHT
+
+
 def _pairing_start(pairing):
     toggl_entry, jira_entry, dist = pairing
     if toggl_entry is not None:
@@ -61,8 +262,8 @@ def _worklog_entry_distance(a, b):
     return (
         + 2 * _worklog_str_dist(a.issue, b.issue)
         + 1 * _worklog_str_dist(a.comment, b.comment)
-        + 2 * _worklog_datetime_dist(a.start, b.start)
-        + 1 * _worklog_datetime_dist(a.stop, b.stop)
+        + _START_WEIGHT * _worklog_datetime_dist(a.start_ms, b.start_ms)
+        + 1 * _worklog_datetime_dist(a.stop_ms, b.stop_ms)
     )
 
 
@@ -70,10 +271,10 @@ def _worklog_str_dist(x, y):
     return 0 if x == y else 1
 
 
-def _worklog_datetime_dist(dt1, dt2):
-    if dt1 is None or dt2 is None:
+def _worklog_datetime_dist(ms1, ms2):
+    if ms1 is None or ms2 is None:
         return 100
-    return abs(dt1 - dt2) / datetime.timedelta(minutes=60)
+    return abs(ms1 - ms2) / _DATETIME_DIST_UNIT
 
 
 class DayBin(object):
@@ -0,0 +1,315 @@
+import datetime
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from . import shared_state, utils
+from .formats import datetime_my_date_format
+
+logger = logging.getLogger(__name__)
+
+DayModel = namedtuple("DayModel", ["day", "entry_ids", "computed_at"])
+ModelMeta = namedtuple("ModelMeta", ["projects", "timings", "snapshot_computed_at"])
+
+_EMPTY_META = ModelMeta(projects=None, timings=None, snapshot_computed_at=None)
+
+
+class DayModelStore(object):
+    # the cached days of a user a request works on, the days it computes are put back with the model cache's save
+    def __init__(self, days=None, meta=None, generation=0):
+        if meta is None:
+            meta = _EMPTY_META
+        self.days = dict(days or {})
+        self.projects = meta.projects
+        self.timings = meta.timings
+        self.snapshot_computed_at = meta.snapshot_computed_at
+        self.generation = generation
+        self.changed = set()
+
+    @property
+    def meta(self):
+        return ModelMeta(projects=self.projects, timings=self.timings, snapshot_computed_at=self.snapshot_computed_at)
+
+    def missing(self, dates, ttl=None):
+        now = time.time()
+        return [
+            date
+            for date in dates
+            if date not in self.days or ttl is not None and self.days[date].computed_at + ttl < now
+        ]
+
+    def put_result(self, result, dates, computed_at, day_bin):
+        rows_by_date = utils.group_by(result["rows"], lambda e: day_bin.date_of(e["start"]))
+        for date in dates:
+            current = self.days.get(date)
+            if current is not None and current.computed_at > computed_at:
+                continue
+            rows = rows_by_date.get(date, [])
+            day = aggregate_actions((date, rows)) if rows else None
+            if day is not None:
+                day["computed_at"] = computed_at
+            self.days[date] = DayModel(
+                day=day,
+                entry_ids=[row["toggl"].tag.id for row in rows if row["toggl"] is not None],
+                computed_at=computed_at,
+            )
+            self.changed.add(date)
+        self.projects = result["projects"]
+        self.timings = result["timings"]
+
+    def build_model(self, dates, delta):
+        day_models = [self.days[date] for date in sorted(dates, reverse=True)]
+        return dict(
+            days=[day_model.day for day_model in day_models if day_model.day is not None],
+            delta=delta,
+            projects=self.projects,
+            entry_ids=[entry_id for day_model in day_models for entry_id in day_model.entry_ids],
+            timings=self.timings,
+            computed_at=min(day_model.computed_at for day_model in day_models),
+        )
+
+
+class ModelCache(object):
+    # the day models are cached per user and date, so every window containing a day reuses it. Every invalidation
+    # bumps the generation, the days of a store read before it are not saved, as they may predate the change
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries is None:
+            max_entries = 128
+        if max_bytes is None:
+            max_bytes = 64 * 1024 * 1024
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._days = OrderedDict()
+        self._sizes = dict()
+        self._total_size = 0
+        self._meta = dict()
+        self._generation = 0
+
+    def get(self, user, dates):
+        with self._lock:
+            days = dict()
+            for date in dates:
+                day_model = self._days.get((user, date))
+                if day_model is not None:
+                    self._days.move_to_end((user, date))
+                    days[date] = day_model
+            return DayModelStore(days, self._meta.get(user), self._generation)
+
+    def save(self, user, store):
+        sizes = {date: approximate_size(store.days[date]) for date in store.changed}
+        with self._lock:
+            if store.generation != self._generation:
+                logger.debug("Not caching the days of %s computed before an invalidation", user)
+                return
+            for date in sorted(store.changed):
+                key = (user, date)
+                current = self._days.get(key)
+                if current is not None and current.computed_at > store.days[date].computed_at:
+                    continue
+                self._remove(key)
+                self._days[key] = store.days[date]
+                self._sizes[key] = sizes[date]
+                self._total_size += sizes[date]
+            self._meta[user] = store.meta
+            self._evict()
+
+    def invalidate(self, user=None, day=None):
+        with self._lock:
+            self._generation += 1
+            for key in list(self._days):
+                if (user is None or key[0] == user) and (day is None or key[1] == day):
+                    self._remove(key)
+            if day is None:
+                for meta_user in list(self._meta):
+                    if user is None or meta_user == user:
+                        del self._meta[meta_user]
+
+    def _remove(self, key):
+        if key in self._days:
+            del self._days[key]
+            self._total_size -= self._sizes.pop(key)
+
+    def _evict(self):
+        # the most recently used day is kept even when it alone is over the budget
+        while len(self._days) > 1 and (len(self._days) > self.max_entries or self._total_size > self.max_bytes):
+            key = next(iter(self._days))
+            self._remove(key)
+            logger.debug("Evicted cached day %s", key)
+
+
+class FragmentCache(object):
+    def __init__(self, max_entries=None):
+        if max_entries is None:
+            max_entries = 256
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()
+
+    def get(self, key, render):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                return fragment
+        fragment = render()
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+class SharedModelCache(object):
+    # same interface as ModelCache, keeps the days in the shared state so every worker process sees them. The
+    # generation check and the writes of a save, and the deletes of an invalidation, are each one transaction
+    def __init__(self, state, max_entries=None, max_bytes=None):
+        if max_entries is None:
+            max_entries = 128
+        if max_bytes is None:
+            max_bytes = 64 * 1024 * 1024
+        self.state = state
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def get(self, user, dates):
+        # the generation is read first, an invalidation after it keeps the days read here from being saved again
+        generation = self._generation()
+        days = dict()
+        for date in dates:
+            day_model = self.state.get("days", _state_key_of(user, date))
+            if day_model is not None:
+                days[date] = day_model
+        self.state.touch("days", [_state_key_of(user, date) for date in days])
+        return DayModelStore(days, self.state.get("model_meta", user), generation)
+
+    def save(self, user, store):
+        with self.state.transaction():
+            if store.generation != self._generation():
+                logger.debug("Not caching the days of %s computed before an invalidation", user)
+                return
+            for date in sorted(store.changed):
+                state_key = _state_key_of(user, date)
+                current = self.state.get("days", state_key)
+                if current is not None and current.computed_at > store.days[date].computed_at:
+                    continue
+                self.state.put("days", state_key, store.days[date])
+            self.state.put("model_meta", user, store.meta)
+        self.state.evict("days", self.max_entries, self.max_bytes)
+
+    def invalidate(self, user=None, day=None):
+        with self.state.transaction():
+            self.state.put("model_generation", "current", self._generation() + 1)
+            for state_key in self.state.keys("days"):
+                key_user, key_date = json.loads(state_key)
+                if (user is None or key_user == user) and (day is None or key_date == day.isoformat()):
+                    self.state.delete("days", state_key)
+            if day is None:
+                for meta_user in self.state.keys("model_meta"):
+                    if user is None or meta_user == user:
+                        self.state.delete("model_meta", meta_user)
+
+    def _generation(self):
+        return self.state.get("model_generation", "current") or 0
+
+
+def _state_key_of(user, date):
+    return json.dumps([user, date.isoformat()])
+
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+
+def get_model_cache(settings):
+    global _model_cache
+    with _model_cache_lock:
+        if _model_cache is None:
+            state = shared_state.get_shared_state(settings)
+            if state is None:
+                _model_cache = ModelCache(
+                    max_entries=settings.models_max_entries,
+                    max_bytes=settings.models_max_bytes,
+                )
+            else:
+                _model_cache = SharedModelCache(
+                    state,
+                    max_entries=settings.models_max_entries,
+                    max_bytes=settings.models_max_bytes,
+                )
+        return _model_cache
+
+
+def approximate_size(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approximate_size(k, seen) + approximate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += approximate_size(vars(obj), seen)
+    elif hasattr(obj, "__slots__"):
+        size += sum(approximate_size(getattr(obj, name, None), seen) for name in obj.__slots__)
+    return size
+
+
+def date_runs(dates):
+    # splits the dates into runs of consecutive days, so each run can be fetched with a single interval
+    runs = []
+    for date in sorted(dates):
+        if runs and runs[-1][-1] + datetime.timedelta(days=1) == date:
+            runs[-1].append(date)
+        else:
+            runs.append([date])
+    return runs
+
+
+def aggregate_actions(day):
+    actions = [
+        action
+        for pairing in day[1]
+        for action in pairing["actions"]
+    ]
+    return {
+        "key": datetime_my_date_format.to_str(day[0]),
+        "day": day[0],
+        "pairings": day[1],
+        "actions": actions,
+        "hash": content_hash(day[0], day[1], actions),
+        "sync_form": {
+            "actions": json.dumps(actions)
+        }
+    }
+
+
+def content_hash(date, pairings, actions):
+    # everything the rendered day depends on, an unchanged hash means the cached fragment is still valid
+    content = [
+        datetime_my_date_format.to_str(date),
+        actions,
+        [
+            [
+                _entry_content(pairing["toggl"]),
+                _entry_content(pairing["jira"]),
+                [[message.message, message.level] for message in pairing["messages"]],
+                pairing["dist"],
+            ]
+            for pairing in pairings
+        ],
+    ]
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _entry_content(entry):
+    if entry is None:
+        return None
+    return [entry.issue, entry.start_ms, entry.stop_ms, entry.comment, repr(entry.tag)]
@@ -1,4 +1,8 @@
 import datetime
+import functools
+
+# timestamps repeat a lot (worklog starts, window bounds), so the parsers remember the recent ones
+_MEMO_SIZE = 4096
 
 
 class DatetimeTogglFormat:
@@ -12,7 +16,7 @@ class DatetimeTogglFormat:
     def from_str(s):
         if s is None:
             return None
-        return datetime.datetime.fromisoformat(s)
+        return _parse_toggl(s)
 
 
 class DatetimeFormat:
@@ -39,11 +43,26 @@ class DatetimeJiraFormat(DatetimeFormat):
     def to_str(self, dt):
         if dt is None:
             return None
-        return self._shrink(super().to_str(dt))
+        offset = dt.utcoffset()
+        if offset is None or offset.microseconds or offset.seconds % 60:
+            return self.to_str_slow(dt)
+        minutes = offset.days * 24 * 60 + offset.seconds // 60
+        sign = "-" if minutes < 0 else "+"
+        minutes = abs(minutes)
+        return "%04d-%02d-%02dT%02d:%02d:%02d.%03d%s%02d%02d" % (
+            dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond // 1000,
+            sign, minutes // 60, minutes % 60,
+        )
 
     def from_str(self, s):
         if s is None:
             return None
+        return _parse_jira(s)
+
+    def to_str_slow(self, dt):
+        return self._shrink(super().to_str(dt))
+
+    def from_str_slow(self, s):
         return super().from_str(self._expand(s))
 
     def _shrink(self, param):
@@ -57,6 +76,42 @@ class DatetimeJiraFormat(DatetimeFormat):
         return s[:23] + "000" + s[23:]
 
 
+@functools.lru_cache(maxsize=_MEMO_SIZE)
+def _parse_toggl(s):
+    return datetime.datetime.fromisoformat(s)
+
+
+@functools.lru_cache(maxsize=_MEMO_SIZE)
+def _parse_jira(s):
+    # fixed layout 2020-01-31T12:34:56.789+0100, anything else goes through strptime
+    if not _has_jira_layout(s):
+        return datetime_jira_format.from_str_slow(s)
+    try:
+        return datetime.datetime(
+            int(s[0:4]), int(s[5:7]), int(s[8:10]),
+            int(s[11:13]), int(s[14:16]), int(s[17:19]), int(s[20:23]) * 1000,
+            tzinfo=_timezone_of(s[23:]),
+        )
+    except ValueError:
+        return datetime_jira_format.from_str_slow(s)
+
+
+def _has_jira_layout(s):
+    if len(s) != 28 or s[4] != "-" or s[7] != "-" or s[10] != "T" or s[13] != ":" or s[16] != ":" or s[19] != ".":
+        return False
+    if s[23] not in ("+", "-"):
+        return False
+    return (s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19] + s[20:23] + s[24:]).isdigit()
+
+
+@functools.lru_cache(maxsize=None)
+def _timezone_of(offset):
+    minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+    if offset[0] == "-":
+        minutes = -minutes
+    return datetime.timezone(datetime.timedelta(minutes=minutes))
+
+
 datetime_my_date_format = DatetimeFormat("%Y-%m-%d")
 datetime_jira_date_format = DatetimeFormat("%Y-%m-%d")
 datetime_jira_format = DatetimeJiraFormat()
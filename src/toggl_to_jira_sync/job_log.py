@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+SKIPPED = "skipped"
+INTERRUPTED = "interrupted"
+SETTLED = (DONE, SKIPPED, INTERRUPTED)
+
+# a jira create found running after a restart may or may not have reached Jira, everything else can be applied again
+_IDEMPOTENT_ACTIONS = {("toggl", "update"), ("jira", "update"), ("jira", "delete")}
+
+Job = namedtuple("Job", ["id", "user", "day", "created", "finished", "actions"])
+JobAction = namedtuple("JobAction", ["seq", "action", "key", "status", "error"])
+
+
+class JobLog(object):
+    def __init__(self, path, stale_after=None):
+        if stale_after is None:
+            stale_after = 10 * 60
+        self.path = path
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " user TEXT NOT NULL,"
+            " day TEXT,"
+            " created REAL NOT NULL,"
+            " finished REAL"
+            ")"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS job_actions ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " action TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " error TEXT,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (job_id, seq)"
+            ")"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS job_actions_key ON job_actions (key, status)")
+
+    @staticmethod
+    def key_of(action):
+        return hashlib.sha1(json.dumps(
+            {k: v for k, v in action.items() if k != "result"},
+            sort_keys=True,
+        ).encode()).hexdigest()
+
+    def create_job(self, user, day, actions, planned_at):
+        # actions applied after planned_at, the time the diff was computed, are skipped instead of applied again
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.execute(
+                    "INSERT INTO jobs (id, user, day, created) VALUES (?, ?, ?, ?)", (job_id, user, day, now)
+                )
+                for seq, action in enumerate(actions):
+                    key = self.key_of(action)
+                    applied = self._connection.execute(
+                        "SELECT 1 FROM job_actions WHERE key = ? AND status = ? AND updated > ? LIMIT 1",
+                        (key, DONE, planned_at),
+                    ).fetchone()
+                    self._connection.execute(
+                        "INSERT INTO job_actions (job_id, seq, action, key, status, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                        (job_id, seq, json.dumps(action), key, SKIPPED if applied else PENDING, now),
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._connection.execute(
+                "SELECT id, user, day, created, finished FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            actions = self._connection.execute(
+                "SELECT seq, action, key, status, error FROM job_actions WHERE job_id = ? ORDER BY seq", (job_id,)
+            ).fetchall()
+        return Job(*job, actions=[
+            JobAction(seq=seq, action=json.loads(action), key=key, status=status, error=error)
+            for seq, action, key, status, error in actions
+        ])
+
+    def unfinished_jobs(self, user):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id FROM jobs WHERE user = ? AND finished IS NULL ORDER BY created", (user,)
+            ).fetchall()
+        return [self.get_job(job_id) for job_id, in rows]
+
+    def resume(self, job_id):
+        # actions left running by a crash are applied again when that is safe, otherwise the next diff shows them.
+        # An action is only taken as cut off after stale_after seconds without an update, until then another tab
+        # or worker may still be running it
+        stale_before = time.time() - self.stale_after
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT seq, action FROM job_actions WHERE job_id = ? AND status = ? AND updated < ?",
+                (job_id, RUNNING, stale_before),
+            ).fetchall()
+            for seq, action in rows:
+                action = json.loads(action)
+                if (action["type"], action["action"]) in _IDEMPOTENT_ACTIONS:
+                    status, error = PENDING, None
+                else:
+                    status, error = INTERRUPTED, "Interrupted, refresh the day to see whether it was applied"
+                resumed = self._connection.execute(
+                    "UPDATE job_actions SET status = ?, error = ?, updated = ?"
+                    " WHERE job_id = ? AND seq = ? AND status = ? AND updated < ?",
+                    (status, error, time.time(), job_id, seq, RUNNING, stale_before),
+                ).rowcount
+                if resumed:
+                    logger.info("Resuming job %s, action %d is %s", job_id, seq, status)
+
+    def start(self, job_id, seq):
+        # claims a pending action, returns False when another request has claimed it already
+        with self._lock:
+            return self._connection.execute(
+                "UPDATE job_actions SET status = ?, error = NULL, updated = ?"
+                " WHERE job_id = ? AND seq = ? AND status = ?",
+                (RUNNING, time.time(), job_id, seq, PENDING),
+            ).rowcount == 1
+
+    def done(self, job_id, seq):
+        with self._lock:
+            self._set_status(job_id, seq, DONE, None)
+
+    def failed(self, job_id, seq, error):
+        with self._lock:
+            self._set_status(job_id, seq, PENDING, str(error))
+
+    def finish(self, job_id):
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), job_id))
+
+    def _set_status(self, job_id, seq, status, error):
+        self._connection.execute(
+            "UPDATE job_actions SET status = ?, error = ?, updated = ? WHERE job_id = ? AND seq = ?",
+            (status, error, time.time(), job_id, seq),
+        )
+
+
+_job_logs = dict()
+_job_logs_lock = threading.Lock()
+
+
+def get_job_log(settings):
+    path = settings.sync_job_log
+    if path is None:
+        # the log has to outlive the process and be seen by every worker, so it always goes to a file
+        path = settings.server_state_path or "sync-jobs.sqlite3"
+    with _job_logs_lock:
+        job_log = _job_logs.get(path)
+        if job_log is None:
+            logger.info("Opening sync job log %s", path)
+            job_log = JobLog(path, stale_after=settings.sync_job_stale_after)
+            _job_logs[path] = job_log
+        return job_log
@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import namedtuple
+
+from toggl_to_jira_sync import utils
+
+TogglMetadata = namedtuple("TogglMetadata", ["workspace", "projects", "projects_by_id", "projects_by_name"])
+
+
+def create_toggl_metadata(workspace, projects):
+    return TogglMetadata(
+        workspace=workspace,
+        projects=projects,
+        projects_by_id=utils.index_by_id(projects),
+        projects_by_name=utils.index_by(projects, "name"),
+    )
+
+
+class TtlCache(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+
+    def get(self, key, compute, ttl):
+        value = self.lookup(key)
+        if value is None:
+            value = compute()
+            self.store(key, value, ttl)
+        return value
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            return entry[1]
+        return None
+
+    def store(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+
+toggl_metadata_cache = TtlCache()
@@ -0,0 +1,99 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "fresh"])
+
+DEFAULT_TTLS = {
+    "data": 5 * 60,
+    "metadata": 24 * 60 * 60,
+}
+
+
+class ResponseCache(object):
+    def __init__(self, path, max_entries=None, ttls=None):
+        if max_entries is None:
+            max_entries = 1000
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " namespace TEXT NOT NULL,"
+            " body TEXT NOT NULL,"
+            " etag TEXT,"
+            " expires REAL NOT NULL,"
+            " accessed REAL NOT NULL"
+            ")"
+        )
+
+    @staticmethod
+    def key_of(namespace, url, params):
+        return json.dumps([namespace, url, params], sort_keys=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT body, etag, expires FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        body, etag, expires = row
+        return CachedResponse(body=json.loads(body), etag=etag, fresh=now < expires)
+
+    def put(self, key, namespace, body, etag, ttl):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, namespace, body, etag, expires, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, json.dumps(body), etag, now + ttl, now),
+            )
+            self._evict()
+
+    def touch(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE responses SET expires = ?, accessed = ? WHERE key = ?", (now + ttl, now, key)
+            )
+
+    def invalidate(self, namespace=None):
+        with self._lock:
+            if namespace is None:
+                self._connection.execute("DELETE FROM responses")
+            else:
+                self._connection.execute("DELETE FROM responses WHERE namespace = ?", (namespace,))
+
+    def _evict(self):
+        self._connection.execute(
+            "DELETE FROM responses WHERE key NOT IN ("
+            " SELECT key FROM responses ORDER BY accessed DESC LIMIT ?"
+            ")",
+            (self.max_entries,),
+        )
+
+
+_caches = dict()
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path, max_entries=None, ttls=None):
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            logger.info("Opening response cache %s", path)
+            cache = ResponseCache(path, max_entries=max_entries, ttls=ttls)
+            _caches[path] = cache
+        return cache
@@ -0,0 +1,173 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from . import api_service, settingsloader, shared_state
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple("Snapshot", ["result", "min_datetime", "max_datetime", "computed_at"])
+
+# with a shared state only the worker holding the lease precomputes, the others just read its snapshots
+_SHARED_POLL_INTERVAL = 10.0
+_LEASE_TTL = 3 * _SHARED_POLL_INTERVAL
+
+
+class ModelScheduler(object):
+    def __init__(self, interval, jitter=None, backoff_base=None, backoff_max=None, state=None):
+        if jitter is None:
+            jitter = interval / 10
+        if backoff_base is None:
+            backoff_base = 10.0
+        if backoff_max is None:
+            backoff_max = 15 * 60.0
+        self.interval = interval
+        self.jitter = jitter
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.state = state
+        self.owner = "{}-{}".format(os.getpid(), uuid.uuid4().hex)
+        self.snapshot = None
+        self.snapshot_updated = None
+        self.generation = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def get_snapshot(self, min_datetime=None, max_datetime=None):
+        snapshot = self._current_snapshot()
+        if snapshot is None:
+            return None
+        if min_datetime is not None and (min_datetime.tzinfo is None or min_datetime < snapshot.min_datetime):
+            return None
+        if max_datetime is not None and (max_datetime.tzinfo is None or max_datetime > snapshot.max_datetime):
+            return None
+        return snapshot
+
+    def invalidate(self):
+        # a recompute already running when this is called fetched too early, its result is dropped by _publish
+        with self._lock:
+            self.generation += 1
+            self.snapshot = None
+            if self.state is not None:
+                with self.state.transaction():
+                    self.state.put("snapshots", "generation", self._current_generation() + 1)
+                    self.state.delete("snapshots", "current")
+        self._wakeup.set()
+
+    def _current_generation(self):
+        if self.state is None:
+            return self.generation
+        return self.state.get("snapshots", "generation") or 0
+
+    def _current_snapshot(self):
+        if self.state is None:
+            return self.snapshot
+        updated = self.state.updated_of("snapshots", "current")
+        if updated is None:
+            return None
+        if updated != self.snapshot_updated:
+            self.snapshot = self.state.get("snapshots", "current")
+            self.snapshot_updated = updated
+        return self.snapshot
+
+    def _run(self):
+        next_run = 0.0
+        while True:
+            self._wakeup.clear()
+            if self._should_recompute(time.monotonic() >= next_run):
+                next_run = time.monotonic() + self._recompute()
+            delay = next_run - time.monotonic()
+            if self.state is not None:
+                delay = _SHARED_POLL_INTERVAL if delay <= 0 else min(delay, _SHARED_POLL_INTERVAL)
+            self._wakeup.wait(delay)
+
+    def _should_recompute(self, due):
+        if self.state is None:
+            return True
+        # holding the lease is renewed on every poll, so it only passes to another worker when this one is gone
+        if not self.state.acquire_lease("scheduler", self.owner, _LEASE_TTL):
+            return False
+        return due or self.failures == 0 and self.state.updated_of("snapshots", "current") is None
+
+    def _recompute(self):
+        # the snapshot is as old as the start of its fetch, anything applied after that may be missing from it
+        generation = self._current_generation()
+        started_at = time.time()
+        try:
+            min_datetime, max_datetime = api_service.get_window(0)
+            result = api_service.inspect_interval(min_datetime, max_datetime)
+        except Exception:
+            self.failures += 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+            logger.exception("Precomputing the diff failed %d times, retrying in %.0fs", self.failures, delay)
+            return delay
+        self.failures = 0
+        snapshot = Snapshot(
+            result=result,
+            min_datetime=min_datetime,
+            max_datetime=max_datetime,
+            computed_at=started_at,
+        )
+        if not self._publish(snapshot, generation):
+            logger.info("Dropping the precomputed diff, it was invalidated while computing it")
+        return self.interval + random.uniform(0, self.jitter)
+
+    def _publish(self, snapshot, generation):
+        with self._lock:
+            if self.state is None:
+                if generation != self.generation:
+                    return False
+                self.snapshot = snapshot
+                return True
+            with self.state.transaction():
+                if generation != self._current_generation():
+                    return False
+                self.state.put("snapshots", "current", snapshot)
+            return True
+
+
+_model_scheduler = None
+_model_scheduler_lock = threading.Lock()
+_model_scheduler_checked = False
+
+
+def ensure_started(settings=None):
+    global _model_scheduler, _model_scheduler_checked
+    with _model_scheduler_lock:
+        if _model_scheduler_checked:
+            return _model_scheduler
+        _model_scheduler_checked = True
+        if settings is None:
+            settings = settingsloader.get_settings()
+        if settings.scheduler_interval is None:
+            return None
+        logger.info("Precomputing the diff every %ss", settings.scheduler_interval)
+        _model_scheduler = ModelScheduler(
+            settings.scheduler_interval,
+            jitter=settings.scheduler_jitter,
+            backoff_base=settings.scheduler_backoff_base,
+            backoff_max=settings.scheduler_backoff_max,
+            state=shared_state.get_shared_state(settings),
+        )
+        _model_scheduler.start()
+        return _model_scheduler
+
+
+def get_snapshot(min_datetime=None, max_datetime=None):
+    if _model_scheduler is None:
+        return None
+    return _model_scheduler.get_snapshot(min_datetime, max_datetime)
+
+
+def invalidate():
+    if _model_scheduler is not None:
+        _model_scheduler.invalidate()
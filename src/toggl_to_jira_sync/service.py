@@ -1,12 +1,20 @@
 import datetime
-from collections import namedtuple
+import json
+import logging
+import queue
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pytz
 from requests.auth import HTTPBasicAuth
 from tzlocal import get_localzone
 
-from toggl_to_jira_sync import settingsloader
+from toggl_to_jira_sync import settingsloader, worklog_store, response_cache, metadata_cache, transport
 from toggl_to_jira_sync.apis import JiraApi, TogglApi
+from toggl_to_jira_sync.worklog_store import IncrementalJiraApi
+
+logger = logging.getLogger(__name__)
 
 
 def create_jira_api(secrets=None, settings=None):
@@ -14,9 +22,67 @@ def create_jira_api(secrets=None, settings=None):
         secrets = settingsloader.get_secrets()
     if settings is None:
         settings = settingsloader.get_settings()
+    auth = HTTPBasicAuth(username=secrets.jira_username, password=secrets.jira_password)
+    rate_limiter = transport.get_rate_limiter(
+        settings.jira_url_base,
+        settings.jira_requests_per_second,
+        burst=settings.jira_requests_burst,
+    )
+    if settings.jira_incremental:
+        return IncrementalJiraApi(
+            api_base=settings.jira_url_base,
+            auth=auth,
+            max_concurrency=settings.jira_max_concurrency,
+            cache=get_response_cache(settings),
+            rate_limiter=rate_limiter,
+            retry_policy=create_retry_policy(settings),
+            store=worklog_store.get_store(settings.jira_url_base, secrets.jira_username),
+        )
     return JiraApi(
         api_base=settings.jira_url_base,
-        auth=HTTPBasicAuth(username=secrets.jira_username, password=secrets.jira_password)
+        auth=auth,
+        max_concurrency=settings.jira_max_concurrency,
+        cache=get_response_cache(settings),
+        rate_limiter=rate_limiter,
+        retry_policy=create_retry_policy(settings),
+    )
+
+
+def create_toggl_api(secrets=None, settings=None):
+    if secrets is None:
+        secrets = settingsloader.get_secrets()
+    if settings is None:
+        settings = settingsloader.get_settings()
+    return TogglApi(
+        secrets=secrets,
+        api_base=settings.toggl_url_base,
+        cache=get_response_cache(settings),
+        metadata_ttl=settings.toggl_metadata_ttl,
+        pool_size=settings.sync_max_concurrency,
+        rate_limiter=transport.get_rate_limiter(
+            settings.toggl_url_base,
+            settings.toggl_requests_per_second,
+            burst=settings.toggl_requests_burst,
+        ),
+        retry_policy=create_retry_policy(settings),
+    )
+
+
+def create_retry_policy(settings):
+    return transport.RetryPolicy(
+        max_retries=settings.http_max_retries,
+        backoff_base=settings.http_backoff_base,
+        backoff_max=settings.http_backoff_max,
+    )
+
+
+def get_response_cache(settings):
+    if settings.cache_path is None:
+        return None
+    return response_cache.get_response_cache(
+        settings.cache_path,
+        max_entries=settings.cache_max_entries,
+        ttls=settings.cache_ttls,
     )
 
 
@@ -27,12 +93,41 @@ def aware_now():
 SecretsAndApis = namedtuple("SecretsAndApis", ["toggl", "jira", "secrets", "settings"])
 
 
+_apis_registry = dict()
+_apis_registry_lock = threading.Lock()
+_secrets_file_key = None
+
+
 def get_apis(secrets=None, settings=None):
+    # the clients of a credential set live as long as the process, so their keep-alive connections are reused by
+    # every handler, sync and executor, they are only rebuilt after the settings or secrets change
+    global _secrets_file_key
+    from_secrets_file = secrets is None
     if secrets is None:
         secrets = settingsloader.get_secrets()
     if settings is None:
         settings = settingsloader.get_settings()
-    toggl_api = TogglApi(secrets=secrets)
+    key = (secrets.toggl_apitoken, secrets.jira_username, secrets.jira_password)
+    with _apis_registry_lock:
+        if from_secrets_file and _secrets_file_key != key:
+            # secrets.json changed, the clients of its previous credentials are dropped along with the credentials
+            if _apis_registry.pop(_secrets_file_key, None) is not None:
+                logger.info("Dropping the API clients of the previous secrets")
+            _secrets_file_key = key
+        apis = _apis_registry.get(key)
+        if apis is None or apis.settings is not settings:
+            logger.info("Creating API clients for %s", secrets.jira_username)
+            apis = create_apis(secrets=secrets, settings=settings)
+            _apis_registry[key] = apis
+        return apis
+
+
+def create_apis(secrets=None, settings=None):
+    if secrets is None:
+        secrets = settingsloader.get_secrets()
+    if settings is None:
+        settings = settingsloader.get_settings()
+    toggl_api = create_toggl_api(secrets=secrets, settings=settings)
     jira_api = create_jira_api(secrets=secrets, settings=settings)
     return SecretsAndApis(
         toggl=toggl_api,
@@ -42,14 +137,89 @@ def get_apis(secrets=None, settings=None):
     )
 
 
+def invalidate_caches(apis):
+    metadata_cache.toggl_metadata_cache.invalidate()
+    apis.toggl.invalidate_cache()
+    apis.jira.invalidate_cache()
+
+
+class ActionSkippedError(Exception):
+    pass
+
+
+ActionProgress = namedtuple("ActionProgress", ["action", "error"])
+
+
 class ActionExecutor(object):
-    def __init__(self, apis=None):
+    def __init__(self, apis=None, max_concurrency=None, toggl_batch_size=None):
         if apis is None:
             apis = get_apis()
+        if max_concurrency is None:
+            max_concurrency = apis.settings.sync_max_concurrency
+        if toggl_batch_size is None:
+            toggl_batch_size = 100
         self.apis = apis
+        self.max_concurrency = max_concurrency
+        self.toggl_batch_size = toggl_batch_size
+
+    def execute_groups(self, action_groups):
+        # Yields an ActionProgress for every action as it finishes. Groups touching the same entry are merged and run
+        # in order, independent groups run in parallel.
+        toggl_batches = coalesce_toggl_updates(action_groups, self.toggl_batch_size)
+        groups = plan_action_groups(action_groups)
+        batched = {id(action): Future() for batch in toggl_batches for action in batch}
+        progress = queue.Queue()
+        # the batches are submitted first, so they all run before a group can wait for the outcome of one
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for batch in toggl_batches:
+                executor.submit(self._execute_toggl_batch, batch, batched)
+            for group in groups:
+                executor.submit(self._execute_group, group, progress.put, batched)
+            for _ in range(sum(len(group) for group in groups)):
+                yield progress.get()
+
+    def _execute_toggl_batch(self, batch, batched):
+        try:
+            self.apis.toggl.bulk_update([action["id"] for action in batch], batch[0]["values"])
+        except Exception as e:
+            logger.warning("Bulk Toggl update of %d entries failed, falling back to single updates: %s", len(batch), e)
+            for action in batch:
+                try:
+                    self.execute(action)
+                except Exception as error:
+                    batched[id(action)].set_exception(error)
+                else:
+                    batched[id(action)].set_result(None)
+            return
+        finally:
+            self.apis.toggl.invalidate_cache()
+        for action in batch:
+            action["result"] = None
+            batched[id(action)].set_result(None)
+
+    def _execute_group(self, group, report, batched=None):
+        # an action sent in a bulk update is not executed again, the group waits for the outcome of its batch
+        if batched is None:
+            batched = dict()
+        for i, action in enumerate(group):
+            try:
+                if id(action) in batched:
+                    batched[id(action)].result()
+                else:
+                    self.execute(action)
+            except Exception as e:
+                logger.exception("Failed to execute action %s", action)
+                report(ActionProgress(action=action, error=e))
+                for skipped in group[i + 1:]:
+                    report(ActionProgress(action=skipped, error=ActionSkippedError("Skipped after a failed action")))
+                return
+            report(ActionProgress(action=action, error=None))
 
     def execute(self, action):
-        action["result"] = getattr(self, "_action_{type}_{action}".format(**action))(action)
+        try:
+            action["result"] = getattr(self, "_action_{type}_{action}".format(**action))(action)
+        finally:
+            getattr(self.apis, action["type"]).invalidate_cache()
 
     def _action_toggl_update(self, action):
         self.apis.toggl.update(action["id"], action["values"])
@@ -62,3 +232,51 @@ class ActionExecutor(object):
 
     def _action_jira_update(self, action):
         self.apis.jira.update_entry(action["issue"], action["id"], action["values"])
+
+
+def coalesce_toggl_updates(action_groups, batch_size):
+    # Toggl updates setting the same values are sent as bulk updates. The updates stay in their groups, so the
+    # actions after them still wait for them and are skipped when they fail.
+    updates_by_values = OrderedDict()
+    for action_group in action_groups:
+        for action in action_group:
+            if action["type"] == "toggl" and action["action"] == "update":
+                values_key = json.dumps(action["values"], sort_keys=True)
+                updates_by_values.setdefault(values_key, []).append(action)
+    batches = []
+    for updates in updates_by_values.values():
+        if len(updates) == 1:
+            continue
+        for i in range(0, len(updates), batch_size):
+            batches.append(updates[i:i + batch_size])
+    return batches
+
+
+def plan_action_groups(action_groups):
+    groups = []
+    group_index_by_key = dict()
+    for action_group in action_groups:
+        if not action_group:
+            continue
+        merged_indices = sorted({
+            group_index_by_key[key]
+            for action in action_group
+            for key in _entity_keys(action)
+            if key in group_index_by_key
+        })
+        group = []
+        for index in merged_indices:
+            group.extend(groups[index])
+            groups[index] = None
+        group.extend(action_group)
+        for action in group:
+            for key in _entity_keys(action):
+                group_index_by_key[key] = len(groups)
+        groups.append(group)
+    return [group for group in groups if group is not None]
+
+
+def _entity_keys(action):
+    if action.get("id") is None:
+        return []
+    return [(action["type"], action["id"])]
@@ -1,4 +1,4 @@
-from flask.sessions import SessionInterface, SessionMixin
+from flask.sessions import SecureCookieSession, SessionInterface, SessionMixin
 
 
 class Session(dict, SessionMixin):
@@ -15,3 +15,31 @@ class SingletonMemorySessionInterface(SessionInterface):
 
     def save_session(self, app, session, response):
         pass
+
+
+class SharedStateSession(SecureCookieSession):
+    def __init__(self, initial):
+        super().__init__(initial)
+        self.loaded = dict(initial)
+
+
+class SharedStateSessionInterface(SessionInterface):
+    # the singleton session kept in the shared state, so every worker process serves the same one. Each field is a
+    # row of its own and only the fields a request changed are written, so workers do not undo each other's changes
+    def __init__(self, state):
+        super().__init__()
+        self.state = state
+
+    def open_session(self, app, request):
+        # only used for its change tracking, nothing goes into a cookie
+        return SharedStateSession(self.state.items("session"))
+
+    def save_session(self, app, session, response):
+        if not session.modified:
+            return
+        with self.state.transaction():
+            for key in session.loaded.keys() - session.keys():
+                self.state.delete("session", key)
+            for key, value in session.items():
+                if key not in session.loaded or session.loaded[key] is not value:
+                    self.state.put("session", key, value)
@@ -1,14 +1,58 @@
 import argparse
 import json
+import logging
+import os
+import threading
 from collections import OrderedDict
 
+logger = logging.getLogger(__name__)
+
+
+class SettingsError(ValueError):
+    pass
+
+
+class WatchedConfig(object):
+    # parses the file once and again only after its modification time or size changes
+    def __init__(self, filename, parse):
+        self.filename = filename
+        self.parse = parse
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._value = None
+
+    def get(self):
+        stat = os.stat(self.filename)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stamp != self._stamp:
+                self._reload(stamp)
+            return self._value
+
+    def _reload(self, stamp):
+        try:
+            value = self.parse(_load_json(self.filename))
+        except (ValueError, KeyError, TypeError) as e:
+            if self._value is None:
+                raise SettingsError("Invalid {}: {}".format(self.filename, e)) from e
+            logger.exception("Invalid %s, keeping the previously loaded one", self.filename)
+        else:
+            if self._value is not None:
+                logger.info("Reloaded %s", self.filename)
+            self._value = value
+        self._stamp = stamp
+
 
 def get_secrets():
-    return Secrets(_load_json("secrets.json"))
+    return _secrets.get()
 
 
 def get_settings():
-    return Settings(_load_json("settings.json"))
+    return _settings.get()
+
+
+def get_user_secrets(filename):
+    return [Secrets(secrets) for secrets in _load_json(filename)]
 
 
 def _load_json(filename):
@@ -21,23 +65,69 @@ class Secrets(object):
         self.toggl_apitoken = secrets["toggl.apitoken"]
         self.jira_username = secrets["jira.username"]
         self.jira_password = secrets["jira.password"]
+        for key in ("toggl.apitoken", "jira.username", "jira.password"):
+            _check_type(secrets, key, str)
 
 
 class Settings(object):
     def __init__(self, settings):
         self.toggl_workspace_name = settings["toggl.workspace.name"]
+        self.toggl_url_base = settings.get("toggl.url_base", "https://www.toggl.com/api/")
+        self.toggl_metadata_ttl = settings.get("toggl.metadata_ttl", None)
+        self.toggl_requests_per_second = settings.get("toggl.requests_per_second", 1)
+        self.toggl_requests_burst = settings.get("toggl.requests_burst", 3)
         self.jira_url_base = settings["jira.url_base"]
+        self.jira_requests_per_second = settings.get("jira.requests_per_second", None)
+        self.jira_requests_burst = settings.get("jira.requests_burst", None)
+        self.http_max_retries = settings.get("http.max_retries", None)
+        self.http_backoff_base = settings.get("http.backoff_base", None)
+        self.http_backoff_max = settings.get("http.backoff_max", None)
+        self.jira_max_concurrency = settings.get("jira.max_concurrency", None)
+        self.jira_incremental = settings.get("jira.incremental", False)
+        self.sync_max_concurrency = settings.get("sync.max_concurrency", 4)
+        self.sync_job_log = settings.get("sync.job_log", None)
+        self.sync_job_stale_after = settings.get("sync.job_stale_after", None)
+        self.scheduler_interval = settings.get("scheduler.interval", None)
+        self.scheduler_jitter = settings.get("scheduler.jitter", None)
+        self.scheduler_backoff_base = settings.get("scheduler.backoff_base", None)
+        self.scheduler_backoff_max = settings.get("scheduler.backoff_max", None)
+        self.pairing_engine = settings.get("pairing.engine", None)
+        self.days_ttl = settings.get("days.ttl", None)
+        self.models_max_entries = settings.get("models.max_entries", None)
+        self.models_max_bytes = settings.get("models.max_bytes", None)
+        self.server_state_path = settings.get("server.state_path", None)
+        self.cache_path = settings.get("cache.path", None)
+        self.cache_max_entries = settings.get("cache.max_entries", None)
+        self.cache_ttls = settings.get("cache.ttls", None)
+        _check_type(settings, "projects", dict)
         self.projects = {
-            k: ProjectSettings(v)
+            k: ProjectSettings(k, v)
             for k, v in settings["projects"].items()
         }
+        if self.pairing_engine not in (None, "auto", "python", "numpy"):
+            raise SettingsError("Unknown pairing.engine {!r}".format(self.pairing_engine))
 
 
 class ProjectSettings(object):
-    def __init__(self, p):
+    def __init__(self, key, p):
+        if not isinstance(p, dict):
+            raise SettingsError("Project {!r} must be an object".format(key))
         self.toggl_project = p.get("toggl.project", None)
         self.toggl_billable = p.get("toggl.billable", True)
         self.jira_skip = p.get("jira.skip", False)
+        _check_type(p, "toggl.project", (str, type(None)), "project {!r}".format(key))
+        _check_type(p, "toggl.billable", bool, "project {!r}".format(key))
+        _check_type(p, "jira.skip", bool, "project {!r}".format(key))
+
+
+def _check_type(config, key, types, context=None):
+    if key in config and not isinstance(config[key], types):
+        where = key if context is None else "{} of {}".format(key, context)
+        raise SettingsError("Invalid {}: {!r}".format(where, config[key]))
+
+
+_secrets = WatchedConfig("secrets.json", Secrets)
+_settings = WatchedConfig("settings.json", Settings)
 
 
 def argparser():
@@ -50,6 +140,21 @@ def parse_args():
     return argparser().parse_args()
 
 
+def batch_argparser():
+    parser = argparse.ArgumentParser(description="Toggl to JIRA worklog sync of several users")
+    parser.add_argument("users", help="JSON list of user secrets, each in the format of secrets.json")
+    parser.add_argument("--delta", type=int, default=0, help="shift of the synced 8 day window in days")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", default=False)
+    parser.add_argument("--report", default=None, help="file to write the JSON report to, stdout by default")
+    parser.add_argument("--interval", type=float, default=None, help="keep syncing every this many seconds")
+    return parser
+
+
+def parse_batch_args():
+    return batch_argparser().parse_args()
+
+
 def _get_config_dict(config, section, prefix):
     result = OrderedDict()
     for k, v in config.items(section):
@@ -0,0 +1,141 @@
+import contextlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState(object):
+    # state shared by the worker processes of one server, every process opens its own connection to the same file
+    def __init__(self, path):
+        self.path = path
+        # reentrant, so the reads and writes of a transaction can take it again
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key)"
+            ")"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " name TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires REAL NOT NULL"
+            ")"
+        )
+
+    def get(self, namespace, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0])
+
+    def items(self, namespace):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, value FROM state WHERE namespace = ?", (namespace,)
+            ).fetchall()
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def updated_of(self, namespace, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT updated FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def put(self, namespace, key, value):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value, updated) VALUES (?, ?, ?, ?)",
+                (namespace, key, blob, time.time()),
+            )
+        return len(blob)
+
+    def touch(self, namespace, keys):
+        # marks the entries as used, evict drops the least recently written or touched ones first
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE state SET updated = ? WHERE namespace = ? AND key = ?",
+                [(time.time(), namespace, key) for key in keys],
+            )
+
+    def delete(self, namespace, key=None):
+        with self._lock:
+            if key is None:
+                self._connection.execute("DELETE FROM state WHERE namespace = ?", (namespace,))
+            else:
+                self._connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def keys(self, namespace):
+        with self._lock:
+            return [row[0] for row in self._connection.execute(
+                "SELECT key FROM state WHERE namespace = ? ORDER BY updated", (namespace,)
+            )]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock of the file up front, so a read-modify-write inside it is not
+        # interleaved with the writes of other processes
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def evict(self, namespace, max_entries, max_bytes):
+        # drops the least recently written or touched entries of the namespace until both limits hold, keeps the
+        # newest one
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key, length(value) FROM state WHERE namespace = ? ORDER BY updated DESC", (namespace,)
+            ).fetchall()
+            total = 0
+            for i, (key, size) in enumerate(rows):
+                total += size
+                if i > 0 and (i >= max_entries or total > max_bytes):
+                    self._connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires"
+                " WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                (name, owner, now + ttl, now),
+            )
+            row = self._connection.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+
+_states = dict()
+_states_lock = threading.Lock()
+
+
+def get_shared_state(settings):
+    if settings.server_state_path is None:
+        return None
+    with _states_lock:
+        state = _states.get(settings.server_state_path)
+        if state is None:
+            logger.info("Opening shared state %s", settings.server_state_path)
+            state = SharedState(settings.server_state_path)
+            _states[settings.server_state_path] = state
+        return state
@@ -81,7 +81,7 @@ Vue.component("sync-day", {
                 } finally {
                     this.day.loading = false;
                 }
-                enqueueDayUpdate(this.day, true);
+                enqueueDayUpdate(this.day, true, true);
             });
         },
         refresh() {
@@ -89,7 +89,7 @@ Vue.component("sync-day", {
                 return;
             }
             this.day.loading = true;
-            enqueueDayUpdate(this.day, true);
+            enqueueDayUpdate(this.day, true, true);
         },
     },
 });
@@ -150,11 +150,11 @@ export function makeDay(date) {
 var queue = new Queue({ workers: 1 });
 
 
-function enqueueDayUpdate(day, priority=false) {
+function enqueueDayUpdate(day, priority=false, refresh=false) {
     day.loading = true;
     queue.submit(async () => {
         try {
-            await _doUpdateDay(day);
+            await _doUpdateDay(day, refresh);
             day.error = null;
         } catch(e) {
             day.error = String(e);
@@ -164,9 +164,11 @@ function enqueueDayUpdate(day, priority=false) {
     }, priority);
 }
 
-async function _doFetchDay(day) {
+async function _doFetchDay(day, refresh=false) {
     var {min, max} = getDayRange(day);
-    var resp = await fetch(`/api/diff?min=${encodeURIComponent(min)}&max=${encodeURIComponent(max)}`);
+    var resp = await fetch(
+        `/api/diff?min=${encodeURIComponent(min)}&max=${encodeURIComponent(max)}${refresh ? '&refresh=1' : ''}`
+    );
     if (!resp.ok) {
         throw new Error(await resp.text());
     }
@@ -194,8 +196,8 @@ function getDayRange(day) {
     return {min, max};
 }
 
-async function _doUpdateDay(day) {
-    var data = await _doFetchDay(day);
+async function _doUpdateDay(day, refresh=false) {
+    var data = await _doFetchDay(day, refresh);
     Object.assign(day, data);
 }
 
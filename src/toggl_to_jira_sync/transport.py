@@ -0,0 +1,109 @@
+import datetime
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+IDEMPOTENT_METHODS = {"get", "put", "delete", "head", "options"}
+
+
+def create_session(auth=None, pool_size=None):
+    if pool_size is None:
+        pool_size = 10
+    session = requests.Session()
+    session.auth = auth
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        if burst is None:
+            burst = 1
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self):
+        # takes a token and returns how long the caller has to wait before using it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+
+class RetryPolicy(object):
+    def __init__(self, max_retries=None, backoff_base=None, backoff_max=None):
+        if max_retries is None:
+            max_retries = 5
+        if backoff_base is None:
+            backoff_base = 0.5
+        if backoff_max is None:
+            backoff_max = 30.0
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def should_retry(self, method, status_code, attempt):
+        if attempt >= self.max_retries:
+            return False
+        if status_code == 429:
+            return True
+        # a failed POST may still have been applied, it is only retried when it was rejected by the rate limit
+        if method.lower() not in IDEMPOTENT_METHODS:
+            return False
+        return status_code is None or status_code >= 500
+
+    def delay_of(self, attempt, resp=None):
+        retry_after = _parse_retry_after(resp.headers.get("Retry-After")) if resp is not None else None
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+_rate_limiters = dict()
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_base, rate, burst=None):
+    if rate is None:
+        return None
+    # the clients of a host share its bucket, changed rate settings get a bucket of their own
+    key = (urlsplit(api_base).netloc, rate, burst)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            limiter = TokenBucket(rate, burst=burst)
+            _rate_limiters[key] = limiter
+        return limiter
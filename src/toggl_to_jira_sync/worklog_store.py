@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from toggl_to_jira_sync.apis import JiraApi, JiraWorklogFilter, _in_range
+
+logger = logging.getLogger(__name__)
+
+# Jira leaves the last minute out of its worklog feeds, the watermark starts early so nothing slips through
+WATERMARK_MARGIN_MS = 60 * 1000
+
+
+class JiraWorklogStore(object):
+    # the worklogs of one author in the union of the ranges fetched so far, the feeds keep all of them current
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.author = None
+        self.ranges = []
+        self.since = None
+        self.worklog = OrderedDict()
+        self.issue_keys = dict()
+
+    def covers(self, worklog_filter):
+        if self.since is None or self.author != worklog_filter.author:
+            return False
+        return any(
+            _range_covers(min_date, max_date, worklog_filter.min_date, worklog_filter.max_date)
+            for min_date, max_date in self.ranges
+        )
+
+    def covers_datetime(self, dt):
+        return any(_in_range(dt, min_date, max_date) for min_date, max_date in self.ranges)
+
+    def reset(self, author):
+        self.author = author
+        self.ranges = []
+        self.since = None
+        self.worklog.clear()
+
+    def add_range(self, min_date, max_date):
+        self.ranges = _merge_ranges(self.ranges + [(min_date, max_date)])
+
+    def put(self, entry):
+        self.worklog[entry.tag.id] = entry
+        issue_id = entry.tag.raw_fields.get("issueId")
+        if issue_id is not None:
+            self.issue_keys[str(issue_id)] = entry.issue
+
+    def remove(self, worklog_id):
+        self.worklog.pop(str(worklog_id), None)
+
+
+class IncrementalJiraApi(JiraApi):
+    def __init__(self, api_base, auth=None, max_concurrency=None, cache=None, rate_limiter=None, retry_policy=None,
+                 store=None):
+        super().__init__(
+            api_base,
+            auth=auth,
+            max_concurrency=max_concurrency,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+        )
+        if store is None:
+            store = JiraWorklogStore()
+        self.store = store
+
+    def get_worklog(self, author=None, min_datetime=None, max_datetime=None):
+        worklog_filter = JiraWorklogFilter(author=author, min_date=min_datetime, max_date=max_datetime)
+        with self.store.lock:
+            if self.store.covers(worklog_filter):
+                result = self._sync_changes()
+            else:
+                result = self._sync_range(worklog_filter)
+            worklog = [
+                entry
+                for entry in self.store.worklog.values()
+                if _in_range(entry.start, min_datetime, max_datetime)
+            ]
+        result.update(
+            worklog_filter=worklog_filter,
+            worklog=worklog,
+        )
+        return result
+
+    def _sync_range(self, worklog_filter):
+        # only the range that is not covered yet is fetched, the ranges fetched before are kept and synced
+        store = self.store
+        if store.author != worklog_filter.author:
+            store.reset(worklog_filter.author)
+        # cached responses may predate the watermark
+        self.invalidate_cache()
+        since = _now_ms() - WATERMARK_MARGIN_MS
+        result = super().get_worklog(
+            author=worklog_filter.author,
+            min_datetime=worklog_filter.min_date,
+            max_datetime=worklog_filter.max_date,
+        )
+        store.add_range(worklog_filter.min_date, worklog_filter.max_date)
+        for entry in result["worklog"]:
+            store.put(entry)
+        if store.since is not None:
+            self._sync_changes()
+        store.since = since
+        result["incremental"] = False
+        return result
+
+    def _sync_changes(self):
+        store = self.store
+        author_filter = JiraWorklogFilter(author=store.author, min_date=None, max_date=None)
+        updated_ids, updated_until = self.get_updated_worklog_ids(store.since)
+        deleted_ids, deleted_until = self.get_deleted_worklog_ids(store.since)
+        for worklog_id in deleted_ids:
+            store.remove(worklog_id)
+        for worklog in self.get_worklogs_by_ids(updated_ids):
+            store.remove(worklog["id"])
+            issue = {"key": self._get_issue_key_cached(worklog["issueId"])}
+            for entry in self._extract_worklogs(author_filter, issue, [worklog]):
+                if store.covers_datetime(entry.start):
+                    store.put(entry)
+        store.since = min(updated_until, deleted_until)
+        logger.info("Incremental Jira sync: %d updated, %d deleted worklogs", len(updated_ids), len(deleted_ids))
+        return {
+            "incremental": True,
+            "updated": len(updated_ids),
+            "deleted": len(deleted_ids),
+        }
+
+    def _get_issue_key_cached(self, issue_id):
+        issue_key = self.store.issue_keys.get(str(issue_id))
+        if issue_key is None:
+            issue_key = self.get_issue_key(issue_id)
+            self.store.issue_keys[str(issue_id)] = issue_key
+        return issue_key
+
+
+_stores = dict()
+_stores_lock = threading.Lock()
+
+
+def get_store(api_base, username):
+    with _stores_lock:
+        store = _stores.get((api_base, username))
+        if store is None:
+            store = JiraWorklogStore()
+            _stores[(api_base, username)] = store
+        return store
+
+
+def _range_covers(outer_min, outer_max, inner_min, inner_max):
+    if outer_min is not None and (inner_min is None or inner_min < outer_min):
+        return False
+    if outer_max is not None and (inner_max is None or inner_max > outer_max):
+        return False
+    return True
+
+
+def _merge_ranges(ranges):
+    # None stands for an open end, touching ranges are merged as the ranges are half open
+    merged = []
+    for min_date, max_date in sorted(ranges, key=lambda r: (r[0] is not None, r[0])):
+        if merged and (merged[-1][1] is None or min_date is None or min_date <= merged[-1][1]):
+            last_min, last_max = merged[-1]
+            merged[-1] = (last_min, None if last_max is None or max_date is None else max(last_max, max_date))
+        else:
+            merged.append((min_date, max_date))
+    return merged
+
+
+def _now_ms():
+    return int(time.time() * 1000)
@@ -0,0 +1,12 @@
+import logging
+import os.path
+import sys
+
+logging.basicConfig(level=logging.INFO)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from toggl_to_jira_sync.application import app, configure
+
+if configure() is None:
+    logging.getLogger(__name__).warning("server.state_path is not set, every worker keeps its own state")
+
+application = app